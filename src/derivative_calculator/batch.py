@@ -0,0 +1,79 @@
+'''
+Cost-aware batch differentiation. Every expression of a batch is
+measured, expressions larger than a threshold are split into pieces
+as in parallel mode, and all of the tasks are submitted to a pool of
+worker processes longest first, so large inputs start early and small
+ones fill the remaining gaps instead of idling cores at the end.
+Main program is batch_deriv.
+
+Longest processing time first:
+https://en.wikipedia.org/wiki/Longest-processing-time-first_scheduling
+'''
+
+import concurrent.futures
+import typing
+from derivative_calculator.tokenizer import Token, Tokenizer, VAR
+from derivative_calculator.math_parser import Num, Var, UnaryOp, BinOp, Parser
+from derivative_calculator.symb_diff_tool import deriv
+from derivative_calculator.metrics import measure
+from derivative_calculator.parallel import split, assemble, DEFAULT_THRESHOLD
+import derivative_calculator.utils as utils
+
+Node = typing.Union[UnaryOp, BinOp, Num, Var]
+
+# expressions with more nodes than this are split across workers
+SPLIT_THRESHOLD = 5000
+
+
+def batch_deriv(exprs: list[typing.Union[str, Node]], var: str,
+                workers: typing.Optional[int] = None,
+                split_threshold: int = SPLIT_THRESHOLD,
+                piece_threshold: int = DEFAULT_THRESHOLD,
+                executor: typing.Optional[concurrent.futures.Executor] = None
+                ) -> list[Node]:
+    '''
+    Returns the derivatives respect to var of exprs, given as strings
+    or parsed trees, in the same order. Expressions larger than
+    split_threshold are split into pieces of at most piece_threshold
+    nodes. Work is submitted to executor, a new pool of workers
+    processes by default, in decreasing order of predicted cost.
+    '''
+    if executor is None:
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+            return batch_deriv(exprs, var, split_threshold=split_threshold,
+                               piece_threshold=piece_threshold, executor=pool)
+
+    token_var = Var(Token(VAR, var))
+    trees = [
+        utils.normalize(Parser(Tokenizer(expr)).parse() if isinstance(expr, str) else expr)
+        for expr in exprs
+    ]
+
+    # (cost, item index, piece index or -1 for a whole expression, tree)
+    tasks: list[tuple[int, int, int, Node]] = []
+    splits: dict[int, tuple[list[Node], list[Node]]] = {}
+    for i, tree in enumerate(trees):
+        metrics = measure(tree, token_var)
+        points: list[Node] = []
+        if metrics.node_count > split_threshold:
+            points, pieces = split(tree, token_var, metrics.sizes, piece_threshold)
+        if not points:
+            tasks.append((metrics.cost(), i, -1, tree))
+            continue
+        splits[i] = (points, pieces)
+        tasks += [(metrics.cost(piece), i, j, piece) for j, piece in enumerate(pieces)]
+
+    tasks.sort(key=lambda task: task[0], reverse=True)
+    futures = {
+        (i, j): executor.submit(deriv, tree, token_var) for _, i, j, tree in tasks
+    }
+
+    results: list[Node] = []
+    for i, tree in enumerate(trees):
+        if i not in splits:
+            results.append(futures[i, -1].result())
+            continue
+        points, pieces = splits[i]
+        derivs = [futures[i, j].result() for j in range(len(pieces))]
+        results.append(assemble(tree, token_var, points, pieces, derivs))
+    return results
@@ -0,0 +1,270 @@
+'''
+Python source generation for parsed math functions and their
+derivatives. Every function is emitted as straight-line code: the
+abstract syntax trees are numbered by structure, subexpressions that
+are used more than once are hoisted into temporaries and computed a
+single time. Generated modules are written to a content-addressed
+cache directory, so later runs import them without parsing or
+differentiating again.
+Main programs are generate_module and export_derivatives.
+'''
+
+import hashlib
+import importlib.util
+import json
+import keyword
+import os
+import tempfile
+import types
+import typing
+from derivative_calculator.tokenizer import (
+    Token, Tokenizer, VAR, PLUS, MINUS, MUL, DIV, POW
+)
+from derivative_calculator.math_parser import Num, Var, UnaryOp, BinOp, Parser
+from derivative_calculator.symb_diff_tool import deriv
+import derivative_calculator.utils as utils
+
+Node = typing.Union[UnaryOp, BinOp, Num, Var]
+
+# bumped whenever the generated code changes, to invalidate cached modules
+FORMAT_VERSION = 2
+
+# deepest inline nesting before a subexpression is hoisted anyway,
+# well below the nesting limit of the python parser
+MAX_NESTING = 40
+
+operators = {PLUS: '+', MINUS: '-', MUL: '*', DIV: '/', POW: '**'}
+
+# valid functions provided by the math module and by numpy
+native_functions = ('exp', 'log', 'sin', 'cos', 'tan')
+
+# valid functions defined over the native ones, as expressions of x
+derived_functions = {
+    'cosec': '1 / sin(x)',
+    'sec': '1 / cos(x)',
+    'cot': 'cos(x) / sin(x)',
+}
+
+module_header = 'from math import %s\n' % ', '.join(native_functions) + ''.join(
+    '\n\ndef %s(x):\n    return %s\n' % item for item in derived_functions.items())
+
+
+def function_namespace(module: typing.Any) -> dict[str, typing.Any]:
+    '''
+    Namespace with the valid functions, the native ones taken from
+    module, math or numpy, and the derived ones defined over them
+    '''
+    namespace = {name: getattr(module, name) for name in native_functions}
+    for name, body in derived_functions.items():
+        namespace[name] = eval('lambda x: %s' % body, dict(namespace))
+    return namespace
+
+
+class Numbering:
+    '''
+    Assigns the same number to structurally equal subtrees. Children
+    are always numbered before their parents, and uses counts how
+    many distinct parents and outputs refer to each number.
+    '''
+    def __init__(self) -> None:
+        self.keys: dict[tuple[typing.Any, ...], int] = {}
+        self.nodes: list[Node] = []
+        self.children: list[tuple[int, ...]] = []
+        self.uses: list[int] = []
+        self.memo: dict[int, int] = {}
+
+    def number(self, node: Node) -> int:
+        if id(node) in self.memo:
+            return self.memo[id(node)]
+
+        children: tuple[int, ...]
+        if isinstance(node, UnaryOp):
+            children = (self.number(node.expr),)
+            key: tuple[typing.Any, ...] = (
+                ('UnaryOp', node.op.type, node.op.value) + children)
+        elif isinstance(node, BinOp):
+            children = (self.number(node.left), self.number(node.right))
+            key = ('BinOp', node.op.type) + children
+        elif isinstance(node, Var):
+            children = ()
+            key = ('Var', node.id)
+        else:
+            children = ()
+            key = ('Num', node.value)
+
+        if key not in self.keys:
+            self.keys[key] = len(self.nodes)
+            self.nodes.append(node)
+            self.children.append(children)
+            self.uses.append(0)
+            for child in children:
+                self.uses[child] += 1
+
+        self.memo[id(node)] = self.keys[key]
+        return self.keys[key]
+
+
+def generate_function(name: str, outputs: list[Node], args: list[str]) -> str:
+    '''
+    Returns the source of a python function called name that takes
+    args as positional arguments and returns the values of outputs,
+    a single value when there is one output and a tuple otherwise
+    '''
+    check_identifier(name)
+    arg_map = arg_names(args)
+    for arg in arg_map.values():
+        check_identifier(arg)
+
+    numbering = Numbering()
+    roots = [numbering.number(output) for output in outputs]
+    for root in roots:
+        numbering.uses[root] += 1
+
+    names: dict[int, str] = {}
+    depth: list[int] = []
+    lines = ['def %s(%s):' % (name, ', '.join(arg_map[arg] for arg in args))]
+
+    for num, node in enumerate(numbering.nodes):
+        children = numbering.children[num]
+        if not children:
+            depth.append(0)
+            continue
+        nesting = 1 + max(depth[child] for child in children)
+        if numbering.uses[num] > 1 or nesting >= MAX_NESTING:
+            names[num] = '_t%d' % len(names)
+            source = _render(num, numbering, names, arg_map)
+            lines.append('    %s = %s' % (names[num], source))
+            nesting = 0
+        depth.append(nesting)
+
+    results = [_render_ref(root, numbering, names, arg_map) for root in roots]
+    if len(results) == 1:
+        lines.append('    return %s' % results[0])
+    else:
+        lines.append('    return (%s)' % ', '.join(results))
+    return '\n'.join(lines) + '\n'
+
+
+def generate_module(functions: dict[str, list[Node]], args: list[str]) -> str:
+    '''
+    Returns the source of a standalone module that defines one
+    function per entry of functions, all of them taking args
+    '''
+    reserved = set(native_functions) | set(derived_functions) | {'ARGS'}
+    for name in functions:
+        if name in reserved:
+            raise Exception('Function name reserved in generated modules: %s' % name)
+    parts = [module_header, 'ARGS = %r\n' % (tuple(args),)]
+    parts += [generate_function(name, outputs, args) for name, outputs in functions.items()]
+    return '\n\n'.join(parts)
+
+
+def export_derivatives(exprs: dict[str, str], variables: list[str],
+                       cache_dir: str) -> types.ModuleType:
+    '''
+    Returns a module with one function per entry of exprs, which
+    maps function names to expressions. Each function takes every
+    variable of the expressions, in alphabetical order, and returns
+    the partial derivatives of its expression respect to variables.
+    Modules are stored in cache_dir under the hash of their inputs
+    and imported from there when they already exist.
+    '''
+    digest = hashlib.sha256(json.dumps(
+        [FORMAT_VERSION, sorted(exprs.items()), variables]
+    ).encode()).hexdigest()[:32]
+    module_name = 'derivatives_%s' % digest
+    path = os.path.join(cache_dir, module_name + '.py')
+
+    if not os.path.exists(path):
+        source = _derivatives_source(exprs, variables)
+        # a module that does not compile is never stored in the cache
+        compile(source, path, 'exec')
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as tmp_file:
+            tmp_file.write(source)
+        os.replace(tmp_path, path)
+
+    return load_module(module_name, path)
+
+
+def compile_function(name: str, outputs: list[Node], args: list[str],
+                     namespace: dict[str, typing.Any]) -> typing.Callable[..., typing.Any]:
+    '''
+    Compiles the function generated for outputs in a copy of
+    namespace, which provides the valid functions it calls
+    '''
+    scope = dict(namespace)
+    exec(compile(generate_function(name, outputs, args), '<%s>' % name, 'exec'), scope)
+    return typing.cast(typing.Callable[..., typing.Any], scope[name])
+
+
+def load_module(module_name: str, path: str) -> types.ModuleType:
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    if spec is None or spec.loader is None:
+        raise Exception('Could not load generated module %s' % path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def arg_names(args: list[str]) -> dict[str, str]:
+    '''
+    Names of the arguments standing for args in generated code.
+    Keywords get underscores appended until they differ from every
+    other argument, so lambda and lambda_ stay distinct.
+    '''
+    taken = set(args)
+    names: dict[str, str] = {}
+    for arg in args:
+        name = arg
+        if keyword.iskeyword(name):
+            while name in taken:
+                name += '_'
+            taken.add(name)
+        names[arg] = name
+    return names
+
+
+def check_identifier(name: str) -> None:
+    if not name.isidentifier() or keyword.iskeyword(name):
+        raise Exception('Invalid identifier for generated code: %s' % name)
+
+
+def _derivatives_source(exprs: dict[str, str], variables: list[str]) -> str:
+    trees = {name: Parser(Tokenizer(expr)).parse() for name, expr in exprs.items()}
+    names = [utils.free_var_names(tree) for tree in trees.values()]
+    args = sorted(set(variables).union(*names))
+    functions = {
+        name: [deriv(tree, Var(Token(VAR, var))) for var in variables]
+        for name, tree in trees.items()
+    }
+    return generate_module(functions, args)
+
+
+def _render_ref(num: int, numbering: Numbering, names: dict[int, str],
+                args: dict[str, str]) -> str:
+    if num in names:
+        return names[num]
+    return _render(num, numbering, names, args)
+
+
+def _render(num: int, numbering: Numbering, names: dict[int, str],
+            args: dict[str, str]) -> str:
+    node = numbering.nodes[num]
+    children = [
+        _render_ref(child, numbering, names, args) for child in numbering.children[num]
+    ]
+
+    if isinstance(node, Num):
+        return repr(node.value) if node.value >= 0 else '(%r)' % node.value
+
+    if isinstance(node, Var):
+        return args.get(node.value, node.value)
+
+    if isinstance(node, UnaryOp):
+        if utils.is_prefix_sign(node):
+            return '(%s%s)' % (node.op.value, children[0])
+        return '%s(%s)' % (node.op.value, children[0])
+
+    return '(%s %s %s)' % (children[0], operators[node.op.type], children[1])
@@ -0,0 +1,180 @@
+'''
+Batch differentiation of large files of expressions, one per line.
+The input file is memory-mapped and a line-offset index is built
+with a single scan, then stored next to the file so later runs load
+it directly. Workers receive ranges of line numbers, read their
+offsets from the index file, map the input themselves and tokenize
+straight from the mapped buffer; only a bounded number of ranges is
+in flight at a time. Every result carries the offset where the next
+line starts, which can be passed back as start_offset to resume an
+interrupted run, and lines that fail carry their error instead of a
+derivative, so one bad line does not stop the run.
+Main program is differentiate_corpus.
+'''
+
+import bisect
+import collections
+import concurrent.futures
+import mmap
+import os
+import sys
+import typing
+from array import array
+from derivative_calculator.tokenizer import Token, Tokenizer, VAR
+from derivative_calculator.math_parser import Var, Parser
+from derivative_calculator.symb_diff_tool import deriv
+from derivative_calculator.interpreter import Interpreter
+
+INDEX_SUFFIX = '.idx'
+
+# (line number, offset of the next line, derivative or None, error or None)
+Result = tuple[int, int, typing.Optional[str], typing.Optional[str]]
+
+# size in bytes of an offset in the index file
+OFFSET_SIZE = array('Q').itemsize
+
+
+def build_index(buffer: typing.Union[bytes, mmap.mmap]) -> 'array[int]':
+    '''
+    Returns the offsets where each line of buffer starts, followed
+    by the size of the buffer, so line i spans index[i]:index[i + 1]
+    '''
+    size = len(buffer)
+    index = array('Q', [0])
+    pos = buffer.find(b'\n')
+    while pos != -1:
+        index.append(pos + 1)
+        pos = buffer.find(b'\n', pos + 1)
+    if index[-1] != size:
+        index.append(size)
+    return index
+
+
+def load_index(path: str) -> 'array[int]':
+    '''
+    Returns the line-offset index of the file at path, read from
+    the index file when it is at least as recent as the input and
+    ends at its size, and built and stored otherwise
+    '''
+    index_path = path + INDEX_SUFFIX
+    size = os.path.getsize(path)
+
+    if (os.path.exists(index_path) and
+            os.path.getmtime(index_path) >= os.path.getmtime(path)):
+        index = array('Q')
+        with open(index_path, 'rb') as index_file:
+            index.frombytes(index_file.read())
+        if index and index[-1] == size:
+            return index
+
+    if size == 0:
+        index = array('Q', [0])
+    else:
+        with open(path, 'rb') as input_file:
+            with mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                index = build_index(buffer)
+
+    tmp_path = index_path + '.tmp'
+    with open(tmp_path, 'wb') as index_file:
+        index.tofile(index_file)
+    os.replace(tmp_path, index_path)
+    return index
+
+
+def read_offsets(path: str, first_line: int, last_line: int) -> 'array[int]':
+    '''
+    Offsets where the lines first_line to last_line of the file at
+    path start, read from its index file without loading the rest
+    '''
+    offsets = array('Q')
+    with open(path + INDEX_SUFFIX, 'rb') as index_file:
+        index_file.seek(first_line * OFFSET_SIZE)
+        offsets.frombytes(index_file.read((last_line - first_line + 1) * OFFSET_SIZE))
+    return offsets
+
+
+def differentiate_lines(path: str, var: str, first_line: int,
+                        last_line: int) -> list[Result]:
+    '''
+    Differentiates the lines of the file at path from first_line up
+    to, but not including, last_line. Blank lines are skipped, and
+    lines that cannot be parsed or differentiated give their error.
+    '''
+    offsets = read_offsets(path, first_line, last_line)
+    token_var = Var(Token(VAR, var))
+    inter = Interpreter()
+    results: list[Result] = []
+    with open(path, 'rb') as input_file:
+        with mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            for i in range(len(offsets) - 1):
+                start, end = offsets[i], offsets[i + 1]
+                tokenizer = Tokenizer(buffer, start, end)
+                tokenizer.skip_whitespace()
+                if tokenizer.current_char is None:
+                    continue
+                try:
+                    tree = Parser(tokenizer).parse()
+                    derivative = inter.visit(deriv(tree, token_var))
+                except Exception as error:
+                    results.append((first_line + i, end, None, str(error) or repr(error)))
+                    continue
+                results.append((first_line + i, end, derivative, None))
+    return results
+
+
+def differentiate_corpus(path: str, var: str, workers: typing.Optional[int] = None,
+                         lines_per_range: int = 10000,
+                         start_offset: int = 0) -> typing.Iterator[Result]:
+    '''
+    Yields the derivative of every non-blank line of the file at
+    path, in order, starting at the line that begins at start_offset.
+    Ranges of lines_per_range lines are differentiated by a pool of
+    worker processes, at most two ranges per worker at a time, or in
+    this process when workers is 1.
+    '''
+    index = load_index(path)
+    first = bisect.bisect_left(index, start_offset)
+    if first == len(index) or index[first] != start_offset:
+        raise Exception('Offset %d is not the start of a line' % start_offset)
+
+    last = len(index) - 1
+    del index
+    ranges = (
+        (line, min(line + lines_per_range, last))
+        for line in range(first, last, lines_per_range)
+    )
+
+    if workers == 1:
+        for first_line, last_line in ranges:
+            yield from differentiate_lines(path, var, first_line, last_line)
+        return
+
+    max_pending = 2 * (workers or os.cpu_count() or 1)
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        pending: collections.deque[concurrent.futures.Future[list[Result]]] = (
+            collections.deque())
+        for first_line, last_line in ranges:
+            if len(pending) == max_pending:
+                yield from pending.popleft().result()
+            pending.append(executor.submit(
+                differentiate_lines, path, var, first_line, last_line))
+        while pending:
+            yield from pending.popleft().result()
+
+
+def main() -> None:
+    '''Usage: corpus.py PATH VAR [START_OFFSET]'''
+    if len(sys.argv) not in (3, 4):
+        print(main.__doc__)
+        return
+    start_offset = int(sys.argv[3]) if len(sys.argv) == 4 else 0
+    for line, next_offset, derivative, error in differentiate_corpus(
+            sys.argv[1], sys.argv[2], start_offset=start_offset):
+        if error is not None:
+            print('%d\t%d\terror: %s' % (line, next_offset, error))
+        else:
+            print('%d\t%d\t%s' % (line, next_offset, derivative))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+'''
+Probabilistic equivalence fingerprints for parsed math functions.
+A tree is evaluated at fixed pseudo-random points over the field of
+integers modulo a large prime. Algebraically equal expressions, such
+as x*2 and 2*x or (x+1)**2 and x**2+2*x+1, get the same fingerprint,
+while different ones collide with negligible probability. Function
+applications, non-integer powers, constants that do not fit below
+the prime and powers of too high a degree are treated as
+uninterpreted: they hash their name and exact arguments, so they are
+equal only when their arguments are. Other constants are reduced
+modulo the prime, so inputs whose constants differ by a multiple of
+it still collide; an optional canonical structural form confirms
+cache hits exactly.
+Main programs are fingerprint and DerivativeCache.
+
+Polynomial identity testing: https://en.wikipedia.org/wiki/Schwartz%E2%80%93Zippel_lemma
+'''
+
+import collections
+import hashlib
+import typing
+from fractions import Fraction
+from derivative_calculator.math_parser import Num, Var, UnaryOp, BinOp
+from derivative_calculator.tokenizer import MINUS
+from derivative_calculator.symb_diff_tool import deriv
+import derivative_calculator.utils as utils
+
+Node = typing.Union[UnaryOp, BinOp, Num, Var]
+Fingerprint = tuple[int, ...]
+
+PRIME = 2 ** 61 - 1
+POINTS = 2
+SEED = 'derivative-calculator'
+
+# constant integer exponents up to this size are also folded exactly
+MAX_EXACT_EXPONENT = 64
+# integer exponents of variable bases from this size on are uninterpreted, as
+# the chance of a collision grows with the degree, and exponents wrap modulo PRIME-1
+MAX_EXPONENT = 2 ** 32
+
+
+def fingerprint(node: Node, points: int = POINTS) -> Fingerprint:
+    '''Values of node modulo PRIME at each of the fixed points'''
+    return tuple(_evaluate(node, k, {})[0] for k in range(points))
+
+
+def canonical_form(node: Node) -> str:
+    '''
+    Structural form of node in which the operands of chains of
+    sums and of products are sorted, so it is equal for trees that
+    differ only in the order of commutative operands
+    '''
+    if isinstance(node, (Num, Var)):
+        return str(node.value)
+
+    if isinstance(node, UnaryOp):
+        return '%s(%s)' % (node.op.value, canonical_form(node.expr))
+
+    if utils.is_sum(node) or utils.is_prod(node):
+        operands: list[str] = []
+        stack: list[Node] = [node]
+        while stack:
+            current = stack.pop()
+            if isinstance(current, BinOp) and current.op.type == node.op.type:
+                stack.extend((current.left, current.right))
+            else:
+                operands.append(canonical_form(current))
+        return '%s[%s]' % (node.op.value, ','.join(sorted(operands)))
+
+    left, right = canonical_form(node.left), canonical_form(node.right)
+    return '%s[%s,%s]' % (node.op.value, left, right)
+
+
+class DerivativeCache:
+    '''
+    Cache of derivatives keyed by the fingerprint of the input and
+    the variable, so syntactically different but equivalent inputs
+    share one entry. With confirm set, a hit also requires equal
+    canonical forms, trading hits on rearranged inputs for an
+    exact check. With max_size set, the least recently used inputs
+    are evicted beyond that many.
+    '''
+    def __init__(self, confirm: bool = False,
+                 max_size: typing.Optional[int] = None) -> None:
+        self.confirm = confirm
+        self.max_size = max_size
+        self.entries: collections.OrderedDict[
+            tuple[Fingerprint, str], list[tuple[str, Node]]] = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def deriv(self, node: Node, var: Var) -> Node:
+        node = utils.normalize(node)
+        key = (fingerprint(node), var.value)
+        form = canonical_form(node) if self.confirm else ''
+        entries = self.entries.setdefault(key, [])
+        self.entries.move_to_end(key)
+        for entry_form, derivative in entries:
+            if entry_form == form:
+                self.hits += 1
+                return derivative
+        self.misses += 1
+        derivative = deriv(node, var)
+        entries.append((form, derivative))
+        if self.max_size is not None and len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+        return derivative
+
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self.entries.values())
+
+    def clear(self) -> None:
+        self.entries = collections.OrderedDict()
+        self.hits = self.misses = 0
+
+
+def _hash(*parts: typing.Any) -> int:
+    digest = hashlib.sha256(repr((SEED,) + parts).encode()).digest()
+    return int.from_bytes(digest[:16], 'big') % PRIME
+
+
+def _inverse(value: int) -> int:
+    return pow(value, PRIME - 2, PRIME)
+
+
+def _number(exact: Fraction) -> int:
+    '''Value of a constant modulo PRIME, or a hash of it when it does not fit below PRIME'''
+    if abs(exact.numerator) >= PRIME or exact.denominator >= PRIME:
+        return _hash('num', exact)
+    return exact.numerator * _inverse(exact.denominator) % PRIME
+
+
+# value modulo PRIME, and the exact value of constant rational subtrees
+Value = tuple[int, typing.Optional[Fraction]]
+
+
+def _evaluate(node: Node, k: int, memo: dict[int, Value]) -> Value:
+    key = id(node)
+    if key not in memo:
+        memo[key] = _evaluate_node(node, k, memo)
+    return memo[key]
+
+
+def _evaluate_node(node: Node, k: int, memo: dict[int, Value]) -> Value:
+    exact: typing.Optional[Fraction]
+    if isinstance(node, Num):
+        number = Fraction(node.value)
+        return _number(number), number
+
+    if isinstance(node, Var):
+        return _hash('var', k, node.value), None
+
+    if isinstance(node, UnaryOp):
+        value, exact = _evaluate(node.expr, k, memo)
+        if utils.is_prefix_sign(node):
+            if node.op.type == MINUS:
+                if exact is not None:
+                    return _number(-exact), -exact
+                return -value % PRIME, None
+            return value, exact
+        return _hash(node.value, value), None
+
+    left, left_exact = _evaluate(node.left, k, memo)
+    right, right_exact = _evaluate(node.right, k, memo)
+
+    if utils.is_sum(node):
+        if left_exact is not None and right_exact is not None:
+            exact = left_exact + right_exact
+            return _number(exact), exact
+        return (left + right) % PRIME, None
+
+    if utils.is_substr(node):
+        if left_exact is not None and right_exact is not None:
+            exact = left_exact - right_exact
+            return _number(exact), exact
+        return (left - right) % PRIME, None
+
+    if utils.is_prod(node):
+        if left_exact is not None and right_exact is not None:
+            exact = left_exact * right_exact
+            return _number(exact), exact
+        return left * right % PRIME, None
+
+    if utils.is_div(node):
+        if right == 0:
+            return _hash('/', left, right), None
+        if left_exact is not None and right_exact:
+            exact = left_exact / right_exact
+            return _number(exact), exact
+        return left * _inverse(right) % PRIME, None
+
+    # powers are exact only for constant integer exponents
+    if right_exact is not None and right_exact.denominator == 1:
+        n = int(right_exact)
+        if left_exact is not None:
+            if abs(n) <= MAX_EXACT_EXPONENT and (left_exact or n >= 0):
+                exact = left_exact ** n
+                return _number(exact), exact
+            return _hash('**', left_exact, n), None
+        if abs(n) >= MAX_EXPONENT or (n < 0 and left == 0):
+            return _hash('**', left, n), None
+        value = pow(left, n, PRIME) if n >= 0 else pow(_inverse(left), -n, PRIME)
+        return value, None
+    return _hash('**', left, right), None
@@ -0,0 +1,219 @@
+'''
+Forward mode automatic differentiation on a parsed math function.
+The abstract syntax tree is walked once with dual numbers, which
+carry a value and its directional derivatives along one or more
+seed directions, so derivative values are obtained without building
+the derivative tree or interpreting it.
+Main programs are forward_eval and forward_gradient.
+
+Dual numbers: https://en.wikipedia.org/wiki/Automatic_differentiation#Dual_numbers
+'''
+
+import math
+import typing
+from derivative_calculator.math_parser import Num, Var, UnaryOp, BinOp
+from derivative_calculator.tokenizer import MINUS
+from derivative_calculator.symbols import symbols
+import derivative_calculator.utils as utils
+
+Node = typing.Union[UnaryOp, BinOp, Num, Var]
+
+
+class Dual:
+    '''
+    Value of a function together with its derivatives along
+    each of the seed directions
+    '''
+    def __init__(self, value: float, tangent: tuple[float, ...]) -> None:
+        self.value = value
+        self.tangent = tangent
+
+    def chain(self, value: float, slope: float) -> 'Dual':
+        '''Dual number of g(self) given g(self.value) and g'(self.value)'''
+        return Dual(value, tuple(slope * t for t in self.tangent))
+
+    def __add__(self, other: 'Dual') -> 'Dual':
+        return Dual(self.value + other.value,
+                    tuple(s + o for s, o in zip(self.tangent, other.tangent)))
+
+    def __sub__(self, other: 'Dual') -> 'Dual':
+        return Dual(self.value - other.value,
+                    tuple(s - o for s, o in zip(self.tangent, other.tangent)))
+
+    def __neg__(self) -> 'Dual':
+        return self.chain(-self.value, -1)
+
+    def __mul__(self, other: 'Dual') -> 'Dual':
+        return Dual(self.value * other.value,
+                    tuple(s * other.value + self.value * o
+                          for s, o in zip(self.tangent, other.tangent)))
+
+    def __truediv__(self, other: 'Dual') -> 'Dual':
+        if other.value == 0:
+            raise Exception('Error: division by zero')
+        value = self.value / other.value
+        return Dual(value, tuple((s - value * o) / other.value
+                                 for s, o in zip(self.tangent, other.tangent)))
+
+    def __pow__(self, other: 'Dual') -> 'Dual':
+        value: float = self.value ** other.value
+        if not any(other.tangent):
+            if other.value == 0:
+                # x**0 is constant, also at x = 0 where x**-1 is undefined
+                return self.chain(value, 0)
+            return self.chain(value, other.value * self.value ** (other.value - 1))
+        log_base = math.log(self.value)
+        return Dual(value, tuple(value * (o * log_base + other.value * s / self.value)
+                                 for s, o in zip(self.tangent, other.tangent)))
+
+
+# value and derivative of every valid function at a point
+functions: dict[str, typing.Callable[[float], tuple[float, float]]] = {
+    'exp': lambda v: (math.exp(v), math.exp(v)),
+    'log': lambda v: (math.log(v), 1 / v),
+    'sin': lambda v: (math.sin(v), math.cos(v)),
+    'cos': lambda v: (math.cos(v), -math.sin(v)),
+    'tan': lambda v: (math.tan(v), 1 / math.cos(v) ** 2),
+    'cosec': lambda v: (1 / math.sin(v), -math.cos(v) / math.sin(v) ** 2),
+    'sec': lambda v: (1 / math.cos(v), math.sin(v) / math.cos(v) ** 2),
+    'cot': lambda v: (math.cos(v) / math.sin(v), -1 / math.sin(v) ** 2),
+}
+
+
+def evaluate(node: Node, env: dict[str, Dual],
+             width: typing.Optional[int] = None) -> Dual:
+    '''
+    Evaluates node with every variable bound to a dual number
+    carrying width tangents, by default as many as those of env.
+    Shared subtrees are evaluated once.
+    '''
+    if width is None:
+        width = len(next(iter(env.values())).tangent) if env else 0
+    ids = {symbols.intern(name): dual for name, dual in env.items()}
+    return _evaluate(node, ids, width, {})
+
+
+def forward_eval(node: Node, var: Var,
+                 point: dict[str, float]) -> tuple[float, float]:
+    '''
+    Returns the value of the function represented by node at point
+    and its derivative respect to var at the same point
+    '''
+    return forward_directional(node, point, {var.value: 1})
+
+
+def forward_directional(node: Node, point: dict[str, float],
+                        direction: dict[str, float]) -> tuple[float, float]:
+    '''
+    Returns the value of the function at point and its derivative
+    along direction, given as a weight per variable
+    '''
+    env = {name: Dual(value, (direction.get(name, 0),)) for name, value in point.items()}
+    result = evaluate(node, env, 1)
+    return result.value, result.tangent[0]
+
+
+def forward_gradient(node: Node, point: dict[str, float],
+                     variables: typing.Optional[list[str]] = None
+                     ) -> tuple[float, list[float]]:
+    '''
+    Returns the value of the function at point and its partial
+    derivatives respect to variables, all of the variables in point
+    by default, computed together in a single walk
+    '''
+    names = list(point) if variables is None else variables
+    env = {
+        name: Dual(value, tuple(float(name == seed) for seed in names))
+        for name, value in point.items()
+    }
+    result = evaluate(node, env, len(names))
+    return result.value, list(result.tangent)
+
+
+def forward_eval_many(node: Node, var: Var,
+                      points: list[dict[str, float]]) -> list[tuple[float, float]]:
+    '''
+    Values and derivatives respect to var at each of the points.
+    The tree is walked once, into a list of its distinct nodes in
+    evaluation order, which is then run for every point.
+    '''
+    tape = _flatten(node)
+    results: list[tuple[float, float]] = []
+    for point in points:
+        env = {
+            symbols.intern(name): Dual(value, (float(name == var.value),))
+            for name, value in point.items()
+        }
+        values: list[Dual] = []
+        for current, args in tape:
+            values.append(_combine(current, [values[i] for i in args], env, 1))
+        results.append((values[-1].value, values[-1].tangent[0]))
+    return results
+
+
+def _flatten(node: Node) -> list[tuple[Node, list[int]]]:
+    '''Distinct nodes in post-order, with the positions of their children'''
+    positions: dict[int, int] = {}
+    tape: list[tuple[Node, list[int]]] = []
+    stack: list[tuple[Node, bool]] = [(node, False)]
+    while stack:
+        current, expanded = stack.pop()
+        if id(current) in positions:
+            continue
+        children = utils.get_children(current)
+        if not expanded:
+            stack.append((current, True))
+            stack.extend((child, False) for child in reversed(children))
+            continue
+        positions[id(current)] = len(tape)
+        tape.append((current, [positions[id(child)] for child in children]))
+    return tape
+
+
+def _evaluate(node: Node, env: dict[int, Dual], width: int,
+              memo: dict[int, Dual]) -> Dual:
+    key = id(node)
+    if key not in memo:
+        args = [_evaluate(child, env, width, memo) for child in utils.get_children(node)]
+        memo[key] = _combine(node, args, env, width)
+    return memo[key]
+
+
+def _combine(node: Node, args: list[Dual], env: dict[int, Dual], width: int) -> Dual:
+    '''Dual number of node given those of its children'''
+    if isinstance(node, Num):
+        return Dual(node.value, (0,) * width)
+
+    if isinstance(node, Var):
+        if node.id not in env:
+            raise Exception('Missing value for variable %s' % node.value)
+        return env[node.id]
+
+    if isinstance(node, UnaryOp):
+        arg = args[0]
+
+        if utils.is_prefix_sign(node):
+            return -arg if node.op.type == MINUS else arg
+
+        if utils.is_func(node):
+            return arg.chain(*functions[node.value](arg.value))
+
+    if isinstance(node, BinOp):
+        left, right = args
+
+        if utils.is_sum(node):
+            return left + right
+
+        if utils.is_substr(node):
+            return left - right
+
+        if utils.is_prod(node):
+            return left * right
+
+        if utils.is_div(node):
+            return left / right
+
+        if utils.is_pow(node):
+            return left ** right
+
+    raise Exception('Could not find any tokens matching input')
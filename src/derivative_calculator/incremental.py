@@ -0,0 +1,173 @@
+'''
+Incremental re-differentiation of edited expressions.
+Parsed trees are hash-consed through structural keys, so subtrees
+that did not change between two versions of an expression map to
+the same node objects, and their derivatives are taken from the
+cache instead of being rebuilt. Only the nodes on the path from an
+edit to the root are differentiated again, and an edit given as the
+path of the replaced subtree is also parsed and interned along that
+path only. Canonical nodes are reference counted, so nodes and cached
+derivatives that the current expression no longer reaches are dropped.
+Main programs are IncrementalDeriv.deriv and IncrementalDeriv.edit.
+'''
+
+import typing
+from derivative_calculator.tokenizer import Tokenizer, Token, VAR
+from derivative_calculator.math_parser import Num, Var, UnaryOp, BinOp, Parser
+from derivative_calculator.symb_diff_tool import deriv
+import derivative_calculator.utils as utils
+
+Node = typing.Union[UnaryOp, BinOp, Num, Var]
+Key = tuple[typing.Any, ...]
+
+
+class Interner:
+    '''
+    Table of canonical nodes. Two structurally equal subtrees
+    interned in the same table are replaced by one node object.
+    Each canonical node counts the canonical parents and the holders
+    that reference it, and is dropped from the table once released
+    by all of them.
+    '''
+    def __init__(self) -> None:
+        self.nodes: dict[Key, Node] = {}
+        # reference counts of the canonical nodes, keyed by node id
+        self.refs: dict[int, int] = {}
+
+    def key(self, node: Node) -> Key:
+        '''
+        Structural key of a node whose children are already
+        canonical, so child identity stands for child structure.
+        '''
+        if isinstance(node, Num):
+            return ('Num', node.value)
+        if isinstance(node, Var):
+            return ('Var', node.id)
+        if isinstance(node, UnaryOp):
+            return ('UnaryOp', node.op.type, node.op.value, id(node.expr))
+        return ('BinOp', node.op.type, id(node.left), id(node.right))
+
+    def intern(self, node: Node) -> Node:
+        '''
+        Returns the canonical node structurally equal to node.
+        Children of node are replaced in place by their canonical
+        versions, so node must not be shared with other callers.
+        Canonical nodes are returned without walking their subtrees.
+        '''
+        if id(node) in self.refs:
+            return node
+        if isinstance(node, UnaryOp):
+            node.expr = self.intern(node.expr)
+        elif isinstance(node, BinOp):
+            node.left = self.intern(node.left)
+            node.right = self.intern(node.right)
+        canonical = self.nodes.setdefault(self.key(node), node)
+        if canonical is node:
+            self.refs[id(node)] = 0
+            for child in utils.get_children(node):
+                self.refs[id(child)] += 1
+        return canonical
+
+    def acquire(self, node: Node) -> None:
+        '''Adds a reference to the canonical node'''
+        self.refs[id(node)] += 1
+
+    def release(self, node: Node) -> list[Node]:
+        '''
+        Removes a reference to the canonical node, and returns the
+        nodes dropped from the table because nothing references them
+        any more
+        '''
+        dropped: list[Node] = []
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            self.refs[id(current)] -= 1
+            if self.refs[id(current)] == 0:
+                del self.refs[id(current)]
+                del self.nodes[self.key(current)]
+                dropped.append(current)
+                stack.extend(utils.get_children(current))
+        return dropped
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+
+class IncrementalDeriv:
+    '''
+    Differentiates successive versions of an expression respect
+    to a single variable, reusing the derivatives of the subtrees
+    the versions have in common.
+    '''
+    def __init__(self, var: str) -> None:
+        self.var = Var(Token(VAR, var))
+        self.interner = Interner()
+        self.cache: dict[int, tuple[Node, Node]] = {}
+        self.root: typing.Optional[Node] = None
+
+    def parse(self, expr: str) -> Node:
+        return self.interner.intern(utils.normalize(Parser(Tokenizer(expr)).parse()))
+
+    def deriv(self, expr: typing.Union[str, Node]) -> Node:
+        '''
+        Returns the derivative of expr, which may be a string or
+        a parsed tree, and makes it the current expression. Trees are
+        normalized before they are interned, so deriv receives
+        canonical nodes it does not need to rebuild.
+        '''
+        if isinstance(expr, str):
+            tree = self.parse(expr)
+        else:
+            tree = self.interner.intern(utils.normalize(expr))
+        return self.set_root(tree)
+
+    def edit(self, path: list[int], expr: typing.Union[str, Node]) -> Node:
+        '''
+        Replaces the subtree of the current expression at path, the
+        list of child indices from the root (0 for the argument or
+        left operand, 1 for the right operand), by expr and returns
+        the new derivative. Only expr and the nodes on path are
+        parsed, normalized, interned and differentiated.
+        '''
+        if self.root is None:
+            raise Exception('Error: there is no expression to edit')
+        ancestors = [self.root]
+        for index in path:
+            children = utils.get_children(ancestors[-1])
+            if not 0 <= index < len(children):
+                raise Exception('Error: invalid path %s' % path)
+            ancestors.append(children[index])
+
+        if isinstance(expr, str):
+            node = self.parse(expr)
+        else:
+            node = self.interner.intern(utils.normalize(expr))
+        for parent, index in zip(reversed(ancestors[:-1]), reversed(path)):
+            children = utils.get_children(parent)
+            children[index] = node
+            if isinstance(parent, UnaryOp):
+                rebuilt: Node = UnaryOp(parent.op, children[0])
+            else:
+                assert isinstance(parent, BinOp)
+                rebuilt = BinOp(children[0], parent.op, children[1])
+            node = self.interner.intern(utils.normalize(rebuilt))
+        return self.set_root(node)
+
+    def set_root(self, tree: Node) -> Node:
+        '''
+        Makes the canonical tree the current expression, dropping the
+        nodes and cached derivatives only the previous one reached,
+        and returns its derivative
+        '''
+        self.interner.acquire(tree)
+        if self.root is not None:
+            for node in self.interner.release(self.root):
+                self.cache.pop(id(node), None)
+        self.root = tree
+        return deriv(tree, self.var, self.cache)
+
+    def clear(self) -> None:
+        self.interner = Interner()
+        self.cache = {}
+        self.root = None
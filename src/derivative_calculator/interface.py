@@ -1,55 +1,207 @@
+'''
+Interactive interface of the derivative calculator.
+A Session keeps the derivative cache, the compiled evaluators and the
+last function and result across inputs, so an analyst can keep
+differentiating, evaluating and taking higher orders for hours
+without paying again for work already done.
+Main program is main.
+'''
+
+import collections
 import os
-from derivative_calculator.tokenizer import Token, Tokenizer, VAR
-from derivative_calculator.math_parser import Var, Parser
-from derivative_calculator.symb_diff_tool import deriv
+import time
+import typing
+from derivative_calculator.tokenizer import Token, Tokenizer, VAR, valid_functions
+from derivative_calculator.math_parser import Num, Var, UnaryOp, BinOp, Parser
 from derivative_calculator.interpreter import Interpreter
+from derivative_calculator.fingerprint import DerivativeCache
+from derivative_calculator.kernels import compile_kernel, Kernel
+import derivative_calculator.utils as utils
+
+try:
+    import readline
+except ImportError:  # line history is not available on every platform
+    readline = None  # type: ignore[assignment]
+
+Node = typing.Union[UnaryOp, BinOp, Num, Var]
+
+HISTORY_FILE = os.path.join(os.path.expanduser('~'), '.derivative_calculator_history')
+
+# least recently used derivatives and compiled evaluators kept by a session
+CACHE_SIZE = 1024
+KERNEL_CACHE_SIZE = 64
+
+help_text = '''\
+ - Enter a function to differentiate it respect to the current variable.
+ - Supported functions are: exp, log, sin, cos, tan, cosec, sec, cot.
+ - Powers are represented by a double asterisk (**).
+ - Variables are a letter followed by letters, digits or underscores,
+   such as x, x1 or theta.
+ - Commands:
+     :var NAME            set the variable to differentiate respect to
+     :again [NAME]        differentiate the last result again
+     :order N             derivative of order N of the last function
+     :eval NAME=VALUE...  evaluate the last result at a point
+     :time on|off         print the time spent in each stage
+     :help                show this message
+     :quit                leave the calculator'''
+
+
+class Session:
+    '''State of an interactive session, kept warm across inputs'''
+    def __init__(self, var: str = 'x', timing: bool = False) -> None:
+        self.var = Var(Token(VAR, var))
+        self.timing = timing
+        self.cache = DerivativeCache(max_size=CACHE_SIZE)
+        self.interpreter = Interpreter()
+        # compiled evaluators keyed by result id, with the result kept alive
+        self.kernels: collections.OrderedDict[int, tuple[Node, list[str], Kernel]] = (
+            collections.OrderedDict())
+        self.function: typing.Optional[Node] = None
+        self.result: typing.Optional[Node] = None
+        self.stages: list[tuple[str, float]] = []
+
+    def handle(self, line: str) -> str:
+        '''Runs a command or differentiates a function, returning the output'''
+        self.stages = []
+        line = line.strip()
+        try:
+            if not line:
+                return ''
+            if line.startswith(':'):
+                words = line[1:].split()
+                if not words:
+                    raise Exception('missing command, try :help')
+                output = self.command(words[0], words[1:])
+            else:
+                output = self.differentiate(line)
+        except Exception as error:
+            return 'Error: %s' % error
+        if self.timing and self.stages:
+            output += '\n' + '  '.join(
+                '%s %.3f ms' % (stage, seconds * 1000) for stage, seconds in self.stages)
+        return output
+
+    def command(self, command: str, args: list[str]) -> str:
+        if command == 'var' and len(args) == 1:
+            check_var(args[0])
+            self.var = Var(Token(VAR, args[0]))
+            return 'Differentiating respect to %s' % args[0]
+
+        if command == 'again' and len(args) <= 1:
+            if args:
+                check_var(args[0])
+                self.var = Var(Token(VAR, args[0]))
+            return self.deriv_output(self.last('result'))
+
+        if command == 'order' and len(args) == 1:
+            if not args[0].isdigit():
+                raise Exception('the order must be a non-negative integer')
+            result = self.last('function')
+            for _ in range(int(args[0])):
+                result = self.timed('deriv', self.cache.deriv, result, self.var)
+            self.result = result
+            return self.output(result)
+
+        if command == 'eval':
+            return 'Value: %r' % self.evaluate(self.last('result'), args)
+
+        if command == 'time' and args in (['on'], ['off']):
+            self.timing = args == ['on']
+            return 'Timing %s' % args[0]
+
+        if command == 'help' and not args:
+            return help_text
+
+        raise Exception('unknown command %s, try :help' % ' '.join([':' + command] + args))
 
+    def differentiate(self, expr: str) -> str:
+        self.function = self.timed('parse', lambda: Parser(Tokenizer(expr)).parse())
+        return self.deriv_output(self.function)
 
-def main():
+    def deriv_output(self, node: Node) -> str:
+        self.result = self.timed('deriv', self.cache.deriv, node, self.var)
+        return self.output(self.result)
+
+    def output(self, result: Node) -> str:
+        return 'Derivative: %s' % self.timed('print', self.interpreter.visit, result)
+
+    def evaluate(self, result: Node, args: list[str]) -> float:
+        point: dict[str, float] = {}
+        for arg in args:
+            name, _, value = arg.partition('=')
+            point[name] = float(value)
+
+        if id(result) not in self.kernels:
+            names = utils.free_var_names(result)
+            kernel = self.timed('compile', compile_kernel, result, self.var, 0, names)
+            self.kernels[id(result)] = (result, names, kernel)
+            if len(self.kernels) > KERNEL_CACHE_SIZE:
+                self.kernels.popitem(last=False)
+        self.kernels.move_to_end(id(result))
+        _, names, kernel = self.kernels[id(result)]
+
+        missing = [name for name in names if name not in point]
+        if missing:
+            raise Exception('missing value for %s' % ', '.join(missing))
+        return typing.cast(float, self.timed('eval', kernel, *(point[n] for n in names))[0])
+
+    def last(self, kind: str) -> Node:
+        node = self.function if kind == 'function' else self.result
+        if node is None:
+            raise Exception('enter a function first')
+        return node
+
+    def timed(self, stage: str, func: typing.Callable[..., typing.Any],
+              *args: typing.Any) -> typing.Any:
+        start = time.perf_counter()
+        result = func(*args)
+        self.stages.append((stage, time.perf_counter() - start))
+        return result
+
+
+def check_var(var: str) -> None:
+    valid = var[:1].isalpha() and var.replace('_', 'a').isalnum()
+    if not valid or var in valid_functions:
+        raise Exception('the variable must be a letter followed by letters, '
+                        'digits or underscores, and not a function name')
+
+
+def main() -> None:
 
     print()
     print('    -------------------------    ')
     print('    - Derivative calculator -    ')
     print('    -------------------------    ')
     print()
-    print(' - Supported functions are: exp, log, sin, cos, tan, cosec, sec, cot.')
-    print(' - Powers are represented by a double asterisk (**).')
-    print(' - Valid variable inputs are single alphabet letters.')
+    print(help_text)
     print()
 
-    while True:
+    if readline is not None:
         try:
-            expr = input('Enter mathematical function: ')
-            if not isinstance(expr, str):
-                raise ValueError
-            break
-        except ValueError:
-            print("Invalid input: the mathematical expression must be in string format.")
+            readline.read_history_file(HISTORY_FILE)
+        except OSError:
+            pass
 
+    session = Session()
     while True:
         try:
-            var = input('Derivate respect to: ')
-            if not (var.isalpha and len(var) == 1):
-                raise ValueError
+            line = input('[d/d%s] ' % session.var.value)
+        except (EOFError, KeyboardInterrupt):
+            print()
             break
-        except ValueError:
-            print("Invalid input: the variable must be a single alphabet letter.")
-
-    expr_ast = Parser(Tokenizer(expr)).parse()  # AST representing function
-    token_var = Var(Token(VAR, var))  # Token object containing variable
-
-    deriv_ast = deriv(expr_ast, token_var)
-    inter = Interpreter()
-    deriv_output = inter.visit(deriv_ast)
-
-    print('Derivative: ', deriv_output)
+        if line.strip() in (':quit', ':q'):
+            break
+        output = session.handle(line)
+        if output:
+            print(output)
 
-    restart = input("Would you like to restart this program? (y/n): ")
-    if restart == "y":
-        os.system('cls||clear')
-        main()
-    if restart == "n":
-        print("Good bye.")
+    if readline is not None:
+        try:
+            readline.write_history_file(HISTORY_FILE)
+        except OSError:
+            pass
+    print("Good bye.")
 
 
 if __name__ == '__main__':
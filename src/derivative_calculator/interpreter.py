@@ -1,6 +1,8 @@
 '''
 Interpreter that visits an abstract syntax tree representing a
 mathematical function and returns the function in string format.
+Trees are printed as they are, so callers that want simplified
+output pass trees built by the make_* rules or utils.normalize.
 Main program is Interpreter.interpret.
 '''
 
@@ -30,7 +32,9 @@ class Interpreter(NodeVisitor):
         result = ''
         left, right = node.left, node.right
 
-        if (utils.is_rational_number(left) or
+        # a negative number is folded from a prefix sign, which binds looser than **
+        negative_base = op == '**' and isinstance(left, Num) and left.value < 0
+        if (utils.is_rational_number(left) or negative_base or
                 (isinstance(left, (UnaryOp, BinOp)) and self.prec[left.op.type] < prec)):
             result += r'(%s)%s' % (self.visit(left), op)
         else:
@@ -42,82 +46,32 @@ class Interpreter(NodeVisitor):
             result += r'%s' % self.visit(right)
         return result
 
-    def visit_BinOp(self, node: BinOp) -> str:  # type: ignore[return]
+    def visit_BinOp(self, node: BinOp) -> str:
         '''
         Tool for visiting a binary operation.
-        We try to simplify the expression if
-        possible, and if not we call the pertaining
-        helper function.
+        The interpreter only formats the tree: simplification
+        happens once, when the tree is built or normalized.
         '''
-        left, right = node.left, node.right
-
-        # simplify left and right nodes in case they are prefix sign expressions
-        if utils.is_prefix_sign(left):
-            left = utils.simplifyPrefixSign(left)
-
-        if utils.is_prefix_sign(right):
-            right = utils.simplifyPrefixSign(right)
-
         if utils.is_sum(node):
-            if isinstance(left, Num) and isinstance(right, Num):
-                return str(left.value + right.value)
-            if utils.is_zero(left):
-                return str(self.visit(right))
-            if utils.is_zero(right):
-                return str(self.visit(left))
             return self.binOpHelper(node, '+', 1)
 
         if utils.is_substr(node):
-            if isinstance(left, Num) and isinstance(right, Num):
-                return str(left.value - right.value)
-            if utils.is_zero(left):
-                return r'-(%s)' % self.visit(right)
-            if utils.is_zero(right):
-                return str(self.visit(left))
             return self.binOpHelper(node, '-', 1)
 
-        elif utils.is_prod(node):
-            if isinstance(left, Num) and isinstance(right, Num):
-                return str(left.value * right.value)
-            if utils.is_zero(left) or utils.is_zero(right):
-                return '0'
-            if utils.is_one(left):
-                return str(self.visit(right))
-            if utils.is_one(right):
-                return str(self.visit(left))
+        if utils.is_prod(node):
             return self.binOpHelper(node, '*', 2)
 
-        elif utils.is_div(node):
-            if utils.is_zero(left):
-                return '0'
-            if utils.is_one(right):
-                return str(self.visit(left))
+        if utils.is_div(node):
             return self.binOpHelper(node, '/', 4)
 
-        elif utils.is_pow(node):
-            if isinstance(left, Num) and isinstance(right, Num):
-                return str(left.value ** right.value)
-            if (utils.is_one(left) or utils.is_zero(right)):
-                return '1'
-            if utils.is_zero(left):
-                return '0'
-            if utils.is_one(right):
-                return str(self.visit(left))
-            return self.binOpHelper(node, '**', 3)
-
-    def visit_UnaryOp(self, node: UnaryOp) -> str:  # type: ignore[return]
+        return self.binOpHelper(node, '**', 3)
+
+    def visit_UnaryOp(self, node: UnaryOp) -> str:
         if utils.is_prefix_sign(node):
-            simpl_node: UnaryOp | Num = utils.simplifyPrefixSign(node)
-            if isinstance(simpl_node, Num):
-                return str(self.visit(simpl_node))
-            else:
-                sign = simpl_node.op.value
-                if isinstance(simpl_node, BinOp):
-                    return r'%s(%s)' % (sign, self.visit(simpl_node.expr))
-                else:
-                    return r'%s%s' % (sign, self.visit(simpl_node.expr))
-        if utils.is_func(node):
-            return r'%s(%s)' % (node.op.value, self.visit(node.expr))
+            if isinstance(node.expr, BinOp):
+                return r'%s(%s)' % (node.op.value, self.visit(node.expr))
+            return r'%s%s' % (node.op.value, self.visit(node.expr))
+        return r'%s(%s)' % (node.op.value, self.visit(node.expr))
 
     def visit_Num(self, node: Num) -> str:  # type: ignore[return]
         return str(node.value)
@@ -125,8 +79,6 @@ class Interpreter(NodeVisitor):
     def visit_Var(self, node: Var) -> str:  # type: ignore[return]
         return str(node.value)
 
-    def interpret(self) -> str:
-        tree = self.parser.parse()
-        if tree is None:
-            return ''
-        return self.visit(tree)
+    def interpret(self, tree: Node) -> str:
+        '''Returns the normalized tree in string format'''
+        return self.visit(utils.normalize(tree))
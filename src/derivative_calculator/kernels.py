@@ -0,0 +1,57 @@
+'''
+Fused evaluation kernels for a function and its derivatives.
+The function and its derivatives up to the requested order are
+compiled together into one generated python function, so the
+subterms the derivatives share with the function, such as the
+function itself in exp and sec or the argument of every chain rule
+factor, are computed once per call. Kernels run on floats with the
+math module or on arrays with numpy, when it is installed.
+Main program is compile_kernel.
+'''
+
+import math
+import typing
+from derivative_calculator.math_parser import Num, Var, UnaryOp, BinOp
+from derivative_calculator.symb_diff_tool import deriv
+from derivative_calculator.codegen import compile_function, function_namespace
+import derivative_calculator.utils as utils
+
+try:
+    import numpy
+except ImportError:  # numpy is optional
+    numpy = None  # type: ignore[assignment]
+
+Node = typing.Union[UnaryOp, BinOp, Num, Var]
+Kernel = typing.Callable[..., tuple[typing.Any, ...]]
+
+math_namespace = function_namespace(math)
+
+
+def numpy_namespace() -> dict[str, typing.Any]:
+    if numpy is None:
+        raise Exception('numpy is required for array kernels')
+    return function_namespace(numpy)
+
+
+def compile_kernel(node: Node, var: Var, order: int = 1,
+                   args: typing.Optional[list[str]] = None,
+                   use_numpy: bool = False) -> Kernel:
+    '''
+    Returns a function that takes args, every variable of node in
+    alphabetical order by default, and returns the tuple of the
+    values of node and of its derivatives respect to var up to order
+    '''
+    outputs = [utils.normalize(node)]
+    cache: dict[int, tuple[Node, Node]] = {}
+    for _ in range(order):
+        # the cache is shared because the derivatives of the next
+        # order revisit the subtrees the previous ones reused
+        outputs.append(deriv(outputs[-1], var, cache))
+
+    if args is None:
+        args = sorted(set(utils.free_var_names(node)) | {var.value})
+    namespace = numpy_namespace() if use_numpy else math_namespace
+    kernel = compile_function('kernel', outputs, args, namespace)
+    if order == 0:
+        return lambda *values: (kernel(*values),)
+    return kernel
@@ -0,0 +1,241 @@
+'''
+Lazy derivatives. The derivative of a tree is a Lazy thunk over the
+source subtree; forcing it applies the derivative rule of its root
+only, with the derivatives of the children that depend on the
+variable left as thunks in turn. Forced results are memoized, and
+thunks of a shared source subtree are shared too, so evaluating the
+derivative at a point, checking whether it is zero or printing a
+preview builds only the parts of the derivative they look at.
+Main programs are lazy_deriv, materialize and LazyInterpreter.
+'''
+
+import typing
+from fractions import Fraction
+from derivative_calculator.math_parser import Num, Var, UnaryOp, BinOp
+from derivative_calculator.tokenizer import MINUS
+from derivative_calculator.symb_diff_tool import deriv
+from derivative_calculator.forward_mode import forward_eval
+from derivative_calculator.interpreter import Interpreter
+import derivative_calculator.utils as utils
+
+Node = typing.Union[UnaryOp, BinOp, Num, Var]
+Number = typing.Union[int, float, Fraction]
+
+
+class Lazy:
+    '''
+    Unevaluated derivative of source respect to var. Thunks are
+    never normalized, so the construction rules and utils.normalize
+    keep the nodes built over them unmarked and leave them in place.
+    '''
+    def __init__(self, source: Node, var: Var,
+                 thunks: typing.Optional[dict[int, 'Lazy']] = None) -> None:
+        self.source = source
+        self.var = var
+        self.normalized = False
+        # the variables of a derivative are among those of its source
+        self.free_vars = source.free_vars
+        self.thunks = {} if thunks is None else thunks
+        self.forced: typing.Optional[Node] = None
+        self.folded: typing.Optional[Number] = None
+        self.checked = False
+
+    def force(self) -> Node:
+        '''Derivative of the root of source, over thunks for its children'''
+        if self.forced is None:
+            cache: dict[int, tuple[Node, Node]] = {}
+            for child in utils.get_children(self.source):
+                if utils.depends_on(child, self.var) and not isinstance(child, (Num, Var)):
+                    thunk = self.thunks.get(id(child)) or Lazy(child, self.var, self.thunks)
+                    self.thunks[id(child)] = thunk
+                    cache[id(child)] = (child, typing.cast(Node, thunk))
+            self.forced = deriv(self.source, self.var, cache)
+        return self.forced
+
+    def constant(self) -> typing.Optional[Number]:
+        '''
+        Number the derivative simplifies to, or None if it does not
+        simplify to a number, forcing only the thunks needed to decide
+        '''
+        if not self.checked:
+            self.folded = 0 if not utils.depends_on(self.source, self.var) else (
+                _constant(self.force()))
+            self.checked = True
+        return self.folded
+
+    def is_zero(self) -> bool:
+        return self.constant() == 0
+
+    def evaluate(self, point: dict[str, float]) -> float:
+        '''Value of the derivative at point, in forward mode without forcing anything'''
+        return forward_eval(self.source, self.var, point)[1]
+
+
+def lazy_deriv(node: Node, var: Var) -> Lazy:
+    '''Returns the derivative of node respect to var as a thunk'''
+    return Lazy(utils.normalize(node), var)
+
+
+def resolve(node: typing.Union[Node, Lazy]) -> Node:
+    '''Forces node until it is not a thunk'''
+    while isinstance(node, Lazy):
+        node = node.force()
+    return node
+
+
+def materialize(node: typing.Union[Node, Lazy]) -> Node:
+    '''
+    Replaces every thunk in node by its forced derivative and
+    normalizes the result, which is then equal to the eager one
+    '''
+    results: dict[int, Node] = {}
+    stack: list[tuple[typing.Union[Node, Lazy], bool]] = [(node, False)]
+    while stack:
+        current, expanded = stack.pop()
+        if id(current) in results:
+            continue
+        if isinstance(current, Lazy):
+            children: list[Node] = [current.force()]
+        else:
+            children = utils.get_children(current)
+        if not expanded:
+            stack.append((current, True))
+            # marked subtrees contain no thunks
+            stack.extend((child, False) for child in children if not child.normalized)
+            continue
+        new = [results.get(id(child), child) for child in children]
+        results[id(current)] = _rebuild(current, new)
+
+    return utils.normalize(results[id(node)])
+
+
+class LazyInterpreter(Interpreter):
+    '''
+    Interpreter for trees containing thunks. Nodes are forced, and
+    the construction rules applied again from their children up, only
+    when they are printed, and nodes deeper than max_depth are shown
+    as "..." without being forced. A preview may show terms that the
+    deeper, unforced levels would simplify away; without max_depth
+    the tree is materialized and printed exactly.
+    '''
+    def __init__(self, max_depth: typing.Optional[int] = None) -> None:
+        super().__init__()
+        self.max_depth = max_depth
+        self.depth = 0
+        # folded nodes by id and remaining depth, with the key node kept alive
+        self.folded: dict[tuple[int, typing.Optional[int]], tuple[object, Node]] = {}
+
+    def visit(self, node: typing.Union[Node, Lazy]) -> str:
+        if self.max_depth is not None and self.depth >= self.max_depth:
+            return '...'
+        self.depth += 1
+        try:
+            # children are folded before binOpHelper chooses parentheses
+            budget = None if self.max_depth is None else self.max_depth - self.depth + 1
+            return super().visit(self.fold(node, budget))
+        finally:
+            self.depth -= 1
+
+    def fold(self, node: typing.Union[Node, Lazy], budget: typing.Optional[int]) -> Node:
+        '''
+        Resolves node and applies the construction rules to its
+        children folded in turn, down to budget levels, until the
+        result no longer changes
+        '''
+        if budget is not None and budget <= 0:
+            return typing.cast(Node, node)
+        key = (id(node), budget)
+        if key in self.folded:
+            return self.folded[key][1]
+
+        below = None if budget is None else budget - 1
+        current = resolve(node)
+        while True:
+            children = utils.get_children(current)
+            folded = [self.fold(child, below) for child in children]
+            if all(new is old for new, old in zip(folded, children)):
+                break
+            current = resolve(_expand(current, folded))
+
+        self.folded[key] = (node, current)
+        self.folded[id(current), budget] = (current, current)
+        return current
+
+    def interpret(self, tree: typing.Union[Node, Lazy]) -> str:
+        self.folded = {}
+        if self.max_depth is None:
+            return super().visit(materialize(tree))
+        return self.visit(tree)
+
+
+def _rebuild(node: typing.Union[Node, Lazy], children: list[Node]) -> Node:
+    if isinstance(node, Lazy):
+        return children[0]
+    if isinstance(node, UnaryOp) and children[0] is not node.expr:
+        return UnaryOp(node.op, children[0])
+    if isinstance(node, BinOp) and (children[0] is not node.left or
+                                    children[1] is not node.right):
+        return BinOp(children[0], node.op, children[1])
+    return node
+
+
+def _expand(node: Node, children: list[Node]) -> Node:
+    '''Applies the construction rule of node to the given children'''
+    if isinstance(node, UnaryOp):
+        if utils.is_func(node):
+            return utils.make_func(node.value, children[0])
+        return utils.make_sign(node.op, children[0])
+    if isinstance(node, BinOp):
+        return utils.make_binOp[node.op.type](children[0], children[1])
+    return node
+
+
+def _constant(node: typing.Union[Node, Lazy]) -> typing.Optional[Number]:
+    '''
+    Number the construction rules fold node into once its thunks are
+    forced, or None, evaluating operands only as far as the rules of
+    make_sum, make_prod and the others need them
+    '''
+    if isinstance(node, Lazy):
+        return node.constant()
+
+    if isinstance(node, Num):
+        return node.value
+
+    if isinstance(node, Var) or utils.is_func(node):
+        return None
+
+    if isinstance(node, UnaryOp):
+        value = _constant(node.expr)
+        return None if value is None or not utils.is_prefix_sign(node) else (
+            -value if node.op.type == MINUS else value)
+
+    left = _constant(node.left)
+    if utils.is_prod(node) or utils.is_div(node):
+        if left == 0:
+            return 0
+        right = _constant(node.right)
+        if utils.is_prod(node) and right == 0:
+            return 0
+        if left is None or right is None:
+            return None
+        if utils.is_prod(node):
+            return left * right
+        return left if right == 1 else None
+
+    if utils.is_sum(node) or utils.is_substr(node):
+        if left is None:
+            return None
+        right = _constant(node.right)
+        if right is None:
+            return None
+        return left + right if utils.is_sum(node) else left - right
+
+    right = _constant(node.right)
+    if left is not None and right is not None:
+        return left ** right
+    if left == 1 or right == 0:
+        return 1
+    if left == 0:
+        return 0
+    return left if right == 1 else None
@@ -18,6 +18,7 @@ from derivative_calculator.tokenizer import (
     LPAREN,
     RPAREN,
 )
+from derivative_calculator.symbols import symbols
 
 Node = typing.Union['UnaryOp', 'BinOp', 'Num', 'Var']
 
@@ -28,6 +29,9 @@ class UnaryOp:
         self.token = self.op = op
         self.value = self.token.value
         self.expr = expr
+        self.normalized = False
+        # bitset of the ids of the variables in the subtree
+        self.free_vars: int = expr.free_vars
 
 
 class BinOp:
@@ -36,6 +40,8 @@ class BinOp:
         self.left = left
         self.token = self.op = op
         self.right = right
+        self.normalized = False
+        self.free_vars: int = left.free_vars | right.free_vars
 
 
 class Num:
@@ -43,6 +49,8 @@ class Num:
     def __init__(self, token: Token) -> None:
         self.token = token
         self.value: int = token.value
+        self.normalized = True
+        self.free_vars = 0
 
 
 class Var:
@@ -50,6 +58,9 @@ class Var:
     def __init__(self, token: Token) -> None:
         self.token = token
         self.value: str = token.value
+        self.id: int = symbols.intern(self.value)
+        self.normalized = True
+        self.free_vars = 1 << self.id
 
 
 class Parser:
@@ -74,7 +85,7 @@ class Parser:
         else:
             self.error()
 
-    def factor(self) -> Node:  # type: ignore[return]
+    def factor(self) -> Node:
         """
         factor : (PLUS | MINUS | FUNC) factor | INTEGER | LPAREN add_substr_expr RPAREN
         """
@@ -109,6 +120,9 @@ class Parser:
             self.eat(RPAREN)
             return paren_node
 
+        # the input ended, or an operator came, where a factor was expected
+        raise Exception('Invalid syntax')
+
     def pow_expr(self) -> Node:
         '''pow_expr: factor (POW factor)*'''
         fact_node: Node = self.factor()
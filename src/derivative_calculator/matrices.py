@@ -0,0 +1,110 @@
+'''
+Jacobian and Hessian matrices of parsed math functions.
+All entries of a matrix are built by one Differentiator: inputs are
+normalized and hash-consed in a single table, and every variable
+keeps one derivative cache shared by all the rows, so subtrees common
+to several functions or several partials are differentiated once.
+Entries whose function does not contain the variable are structural
+zeros, read from the free variable bitsets without differentiating,
+and can be left out of a sparse result. Mixed partials of a Hessian
+are computed once and shared with the symmetric entry.
+Main programs are jacobian and hessian.
+'''
+
+import typing
+from derivative_calculator.tokenizer import Token, Tokenizer, INTEGER, VAR
+from derivative_calculator.math_parser import Num, Var, UnaryOp, BinOp, Parser
+from derivative_calculator.symb_diff_tool import deriv
+from derivative_calculator.incremental import Interner
+import derivative_calculator.utils as utils
+
+Node = typing.Union[UnaryOp, BinOp, Num, Var]
+Matrix = list[list[Node]]
+Sparse = dict[tuple[int, int], Node]
+
+
+class Differentiator:
+    '''
+    Takes partial derivatives respect to a fixed list of variables,
+    sharing one table of canonical nodes and one derivative cache
+    per variable between all the functions it is given
+    '''
+    def __init__(self, variables: list[str]) -> None:
+        self.vars = [Var(Token(VAR, var)) for var in variables]
+        self.interner = Interner()
+        self.caches: list[dict[int, tuple[Node, Node]]] = [{} for _ in variables]
+        self.zero = Num(Token(INTEGER, 0))
+
+    def parse(self, expr: typing.Union[str, Node]) -> Node:
+        '''
+        Normalized and interned tree of expr. Trees are interned in
+        place, so they must not be shared with other callers.
+        '''
+        if isinstance(expr, str):
+            expr = Parser(Tokenizer(expr)).parse()
+        return self.interner.intern(utils.normalize(expr))
+
+    def partial(self, node: Node, j: int) -> typing.Optional[Node]:
+        '''Derivative of node respect to the j-th variable, None for a structural zero'''
+        if not utils.depends_on(node, self.vars[j]):
+            return None
+        return deriv(node, self.vars[j], self.caches[j])
+
+
+def jacobian(exprs: list[typing.Union[str, Node]], variables: list[str],
+             sparse: bool = False) -> typing.Union[Matrix, Sparse]:
+    '''
+    Matrix of the derivatives of each of exprs, given as strings or
+    parsed trees, respect to each of variables. With sparse set, the
+    result maps (row, column) to the entries that are not structural
+    zeros.
+    '''
+    differentiator = Differentiator(variables)
+    entries: Sparse = {}
+    for i, expr in enumerate(exprs):
+        tree = differentiator.parse(expr)
+        for j in range(len(variables)):
+            entry = differentiator.partial(tree, j)
+            if entry is not None:
+                entries[i, j] = entry
+
+    if sparse:
+        return entries
+    return _dense(entries, len(exprs), len(variables), differentiator.zero)
+
+
+def hessian(expr: typing.Union[str, Node], variables: list[str],
+            sparse: bool = False) -> typing.Union[Matrix, Sparse]:
+    '''
+    Matrix of the second derivatives of expr respect to each pair of
+    variables. Each mixed partial is computed once, and the same tree
+    is the entry of both (i, j) and (j, i). With sparse set, the
+    result maps (row, column) to the entries that are not structural
+    zeros.
+    '''
+    differentiator = Differentiator(variables)
+    tree = differentiator.parse(expr)
+
+    gradient: list[typing.Optional[Node]] = []
+    for i in range(len(variables)):
+        entry = differentiator.partial(tree, i)
+        # the first derivatives are interned too, so the second ones
+        # reuse the cached derivatives of the subtrees they have in common
+        gradient.append(None if entry is None else differentiator.interner.intern(entry))
+
+    entries: Sparse = {}
+    for i, first in enumerate(gradient):
+        if first is None:
+            continue
+        for j in range(i, len(variables)):
+            entry = differentiator.partial(first, j)
+            if entry is not None:
+                entries[i, j] = entries[j, i] = entry
+
+    if sparse:
+        return entries
+    return _dense(entries, len(variables), len(variables), differentiator.zero)
+
+
+def _dense(entries: Sparse, rows: int, columns: int, zero: Node) -> Matrix:
+    return [[entries.get((i, j), zero) for j in range(columns)] for i in range(rows)]
@@ -0,0 +1,98 @@
+'''
+Cost model for abstract syntax trees. A single walk over the tree
+records the size and depth of every subtree, histograms of operators
+and functions, and a prediction of the size of the derivative of
+every subtree, taken from the number of nodes each derivative rule
+builds before simplification.
+Main program is measure.
+'''
+
+import typing
+from derivative_calculator.math_parser import Num, Var, UnaryOp, BinOp
+import derivative_calculator.utils as utils
+
+Node = typing.Union[UnaryOp, BinOp, Num, Var]
+
+
+class Metrics:
+    '''Metrics of a tree and of each of its subtrees, keyed by node id'''
+    def __init__(self, node: Node, var: typing.Optional[Var] = None) -> None:
+        self.sizes: dict[int, int] = {}
+        self.depths: dict[int, int] = {}
+        self.predicted: dict[int, int] = {}
+        self.operators: dict[str, int] = {}
+        self.functions: dict[str, int] = {}
+
+        stack: list[tuple[Node, bool]] = [(node, False)]
+        while stack:
+            current, expanded = stack.pop()
+            if id(current) in self.sizes:
+                continue
+            children = utils.get_children(current)
+            if not expanded:
+                stack.append((current, True))
+                stack.extend((child, False) for child in children)
+                continue
+            self.sizes[id(current)] = 1 + sum(self.sizes[id(child)] for child in children)
+            self.depths[id(current)] = 1 + max(
+                (self.depths[id(child)] for child in children), default=0)
+            self.predicted[id(current)] = self._predict(current, var)
+            if isinstance(current, UnaryOp) and utils.is_func(current):
+                name = current.op.value
+                self.functions[name] = self.functions.get(name, 0) + 1
+            elif isinstance(current, (UnaryOp, BinOp)):
+                op = current.op.type
+                self.operators[op] = self.operators.get(op, 0) + 1
+
+        self.node_count = self.sizes[id(node)]
+        self.depth = self.depths[id(node)]
+        self.predicted_size = self.predicted[id(node)]
+
+    def cost(self, node: typing.Optional[Node] = None) -> int:
+        '''Work estimate for differentiating node, the whole tree by default'''
+        if node is None:
+            return self.node_count + self.predicted_size
+        return self.sizes[id(node)] + self.predicted[id(node)]
+
+    def _predict(self, node: Node, var: typing.Optional[Var]) -> int:
+        if isinstance(node, (Num, Var)):
+            return 1
+        if var is not None and not utils.depends_on(node, var):
+            return 1
+
+        if isinstance(node, UnaryOp):
+            size, d_expr = self.sizes[id(node.expr)], self.predicted[id(node.expr)]
+            if utils.is_prefix_sign(node):
+                return d_expr + 1
+            if node.value in ('sec', 'cosec'):
+                return 2 * size + d_expr + 5
+            return size + d_expr + 4
+
+        assert isinstance(node, BinOp)
+        l_size, r_size = self.sizes[id(node.left)], self.sizes[id(node.right)]
+        d_left, d_right = self.predicted[id(node.left)], self.predicted[id(node.right)]
+
+        if utils.is_sum(node) or utils.is_substr(node):
+            return d_left + d_right + 1
+
+        if utils.is_prod(node):
+            return l_size + r_size + d_left + d_right + 3
+
+        if utils.is_div(node):
+            return l_size + 2 * r_size + d_left + d_right + 7
+
+        return 2 * (l_size + r_size) + d_left + d_right + 9
+
+
+def measure(node: Node, var: typing.Optional[Var] = None) -> Metrics:
+    '''
+    Returns the metrics of node. The predicted derivative sizes are
+    respect to var, or to a variable occurring everywhere if var is
+    not given.
+    '''
+    return Metrics(node, var)
+
+
+def subtree_sizes(node: Node) -> dict[int, int]:
+    '''Number of nodes of every subtree of node, keyed by node id'''
+    return measure(node).sizes
@@ -0,0 +1,93 @@
+'''
+Parallel differentiation of a single large expression.
+The tree is split at sums, differences and products whose subtree
+is larger than a threshold. The subtrees hanging below those split
+points are independent pieces that worker processes differentiate,
+and the derivative is reassembled bottom-up by calling deriv on each
+split point with the derivatives of its children already cached, so
+the usual make_sum and make_prod rules join the pieces.
+Main program is parallel_deriv.
+'''
+
+import concurrent.futures
+import itertools
+import os
+import typing
+from derivative_calculator.math_parser import Num, Var, UnaryOp, BinOp
+from derivative_calculator.symb_diff_tool import deriv
+from derivative_calculator.metrics import subtree_sizes
+import derivative_calculator.utils as utils
+
+Node = typing.Union[UnaryOp, BinOp, Num, Var]
+
+# subtrees with at most this many nodes are never split
+DEFAULT_THRESHOLD = 500
+
+
+def split(node: Node, var: Var, sizes: dict[int, int],
+          threshold: int) -> tuple[list[Node], list[Node]]:
+    '''
+    Returns the split points of node, parents before children,
+    and the pieces below them that depend on var
+    '''
+    points: list[Node] = []
+    pieces: list[Node] = []
+    seen: set[int] = set()
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        if id(current) in seen or not utils.depends_on(current, var):
+            continue
+        seen.add(id(current))
+        splittable = (utils.is_sum(current) or utils.is_substr(current) or
+                      utils.is_prod(current))
+        if isinstance(current, BinOp) and sizes[id(current)] > threshold and splittable:
+            points.append(current)
+            stack.extend((current.right, current.left))
+        else:
+            pieces.append(current)
+    return points, pieces
+
+
+def parallel_deriv(node: Node, var: Var, workers: typing.Optional[int] = None,
+                   threshold: int = DEFAULT_THRESHOLD,
+                   executor: typing.Optional[concurrent.futures.Executor] = None) -> Node:
+    '''
+    Returns the derivative of node respect to var, differentiating
+    the pieces of the tree in an executor, a new pool of workers
+    processes by default. Trees with no split point are
+    differentiated in this process.
+    '''
+    node = utils.normalize(node)
+    points, pieces = split(node, var, subtree_sizes(node), threshold)
+    if not points:
+        return deriv(node, var)
+
+    if executor is None:
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+            derivs = list(pool.map(deriv, pieces, itertools.repeat(var),
+                                   chunksize=_chunksize(len(pieces), workers)))
+    else:
+        derivs = list(executor.map(deriv, pieces, itertools.repeat(var)))
+
+    return assemble(node, var, points, pieces, derivs)
+
+
+def assemble(node: Node, var: Var, points: list[Node], pieces: list[Node],
+             derivs: list[Node]) -> Node:
+    '''
+    Returns the derivative of node given its split points, as
+    returned by split, and the derivatives of its pieces
+    '''
+    cache: dict[int, tuple[Node, Node]] = {
+        id(piece): (piece, piece_deriv) for piece, piece_deriv in zip(pieces, derivs)
+    }
+    # children of a split point are reassembled before it, so each
+    # call applies a single rule and the recursion stays shallow
+    for point in reversed(points):
+        deriv(point, var, cache)
+    return cache[id(node)][1]
+
+
+def _chunksize(tasks: int, workers: typing.Optional[int]) -> int:
+    return max(1, tasks // (4 * (workers or os.cpu_count() or 1)))
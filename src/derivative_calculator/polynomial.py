@@ -0,0 +1,265 @@
+'''
+Polynomial fast path for the symbolic differentiation tool.
+Subtrees that are polynomials or rational functions of the variable
+with numeric coefficients are detected in one bottom-up pass and
+converted to sparse coefficient maps, where derivatives are taken
+in time linear in the number of terms. The results are converted
+back to abstract syntax trees in expanded or Horner form and handed
+to deriv through its cache, so only the rest of the tree goes
+through the product and power rules.
+Main program is poly_deriv.
+
+Horner's method: https://en.wikipedia.org/wiki/Horner%27s_method
+'''
+
+import typing
+from fractions import Fraction
+from derivative_calculator.math_parser import Num, Var, UnaryOp, BinOp
+from derivative_calculator.tokenizer import Token, INTEGER, MINUS
+from derivative_calculator.symb_diff_tool import deriv
+import derivative_calculator.utils as utils
+
+Node = typing.Union[UnaryOp, BinOp, Num, Var]
+# exponent -> coefficient, without zero coefficients
+Poly = dict[int, Fraction]
+# numerator and denominator
+Rational = tuple[Poly, Poly]
+
+EXPANDED, HORNER = 'expanded', 'horner'
+
+# integer powers that would expand past this degree are left to deriv
+MAX_DEGREE = 1000
+
+
+def poly_add(a: Poly, b: Poly) -> Poly:
+    result = dict(a)
+    for k, c in b.items():
+        result[k] = result.get(k, Fraction(0)) + c
+    return {k: c for k, c in result.items() if c}
+
+
+def poly_scale(a: Poly, c: Fraction) -> Poly:
+    return {k: c * v for k, v in a.items()} if c else {}
+
+
+def poly_mul(a: Poly, b: Poly) -> Poly:
+    result: Poly = {}
+    for i, c in a.items():
+        for j, d in b.items():
+            result[i + j] = result.get(i + j, Fraction(0)) + c * d
+    return {k: c for k, c in result.items() if c}
+
+
+def poly_pow(a: Poly, n: int) -> Poly:
+    result: Poly = {0: Fraction(1)}
+    while n:
+        if n & 1:
+            result = poly_mul(result, a)
+        n >>= 1
+        if n:
+            a = poly_mul(a, a)
+    return result
+
+
+def poly_deriv_coeffs(a: Poly) -> Poly:
+    return {k - 1: k * c for k, c in a.items() if k}
+
+
+def degree(a: Poly) -> int:
+    return max(a, default=0)
+
+
+def is_constant(a: Poly) -> bool:
+    return not a or a.keys() == {0}
+
+
+def rational_add(x: Rational, y: Rational, sign: int = 1) -> Rational:
+    (a, b), (c, d) = x, y
+    if b == d:
+        return poly_add(a, poly_scale(c, Fraction(sign))), b
+    return _reduce(poly_add(poly_mul(a, d), poly_scale(poly_mul(b, c), Fraction(sign))),
+                   poly_mul(b, d))
+
+
+def rational_mul(x: Rational, y: Rational) -> Rational:
+    return _reduce(poly_mul(x[0], y[0]), poly_mul(x[1], y[1]))
+
+
+def rational_div(x: Rational, y: Rational) -> typing.Optional[Rational]:
+    if not y[0]:
+        return None
+    return _reduce(poly_mul(x[0], y[1]), poly_mul(x[1], y[0]))
+
+
+def rational_pow(x: Rational, y: Rational) -> typing.Optional[Rational]:
+    '''x**y when y is an integer constant and the result is not too large'''
+    if not is_constant(y[0]) or y[1] != {0: Fraction(1)}:
+        return None
+    exponent = y[0].get(0, Fraction(0))
+    if exponent.denominator != 1:
+        return None
+    n = int(exponent)
+    if abs(n) * max(degree(x[0]), degree(x[1])) > MAX_DEGREE:
+        return None
+    if n < 0:
+        if not x[0]:
+            return None
+        x, n = (x[1], x[0]), -n
+    return _reduce(poly_pow(x[0], n), poly_pow(x[1], n))
+
+
+def rational_deriv(x: Rational) -> Rational:
+    num, den = x
+    if is_constant(den):
+        return poly_deriv_coeffs(num), den
+    return _reduce(
+        poly_add(poly_mul(poly_deriv_coeffs(num), den),
+                 poly_scale(poly_mul(num, poly_deriv_coeffs(den)), Fraction(-1))),
+        poly_mul(den, den)
+    )
+
+
+def to_rationals(node: Node, var: Var) -> dict[int, typing.Optional[Rational]]:
+    '''
+    Returns, for every subtree of node keyed by id, its numerator
+    and denominator as polynomials in var with numeric coefficients,
+    or None when the subtree is not a rational function of var
+    '''
+    results: dict[int, typing.Optional[Rational]] = {}
+    stack: list[tuple[Node, bool]] = [(node, False)]
+    while stack:
+        current, expanded = stack.pop()
+        if id(current) in results:
+            continue
+        children = utils.get_children(current)
+        if not expanded:
+            stack.append((current, True))
+            stack.extend((child, False) for child in children)
+            continue
+        results[id(current)] = _to_rational(
+            current, var, [results[id(child)] for child in children])
+    return results
+
+
+def from_poly(poly: Poly, var: Var, form: str = EXPANDED) -> Node:
+    '''Abstract syntax tree of poly in expanded or Horner form'''
+    if not poly:
+        return Num(Token(INTEGER, 0))
+    degrees = sorted(poly, reverse=True)
+
+    if form == HORNER:
+        result = _coeff(poly[degrees[0]])
+        for prev, k in zip(degrees, degrees[1:]):
+            shifted = utils.make_prod(result, _monomial(var, prev - k))
+            if poly[k] < 0:
+                result = utils.make_substr(shifted, _coeff(-poly[k]))
+            else:
+                result = utils.make_sum(shifted, _coeff(poly[k]))
+        return utils.make_prod(result, _monomial(var, degrees[-1]))
+
+    result = _term(poly[degrees[0]], var, degrees[0])
+    for k in degrees[1:]:
+        if poly[k] < 0:
+            result = utils.make_substr(result, _term(-poly[k], var, k))
+        else:
+            result = utils.make_sum(result, _term(poly[k], var, k))
+    return result
+
+
+def from_rational(x: Rational, var: Var, form: str = EXPANDED) -> Node:
+    num, den = x
+    if is_constant(den):
+        return from_poly(poly_scale(num, 1 / den[0]), var, form)
+    return utils.make_div(from_poly(num, var, form), from_poly(den, var, form))
+
+
+def poly_deriv(node: Node, var: Var, form: str = EXPANDED) -> Node:
+    '''
+    Returns the derivative of node respect to var. The largest
+    subtrees that are rational functions of var are differentiated
+    as coefficient maps and printed in form, and deriv handles
+    the rest of the tree.
+    '''
+    node = utils.normalize(node)
+    rationals = to_rationals(node, var)
+    root = rationals[id(node)]
+    if root is not None:
+        return from_rational(rational_deriv(root), var, form)
+
+    cache: dict[int, tuple[Node, Node]] = {}
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        if id(current) in cache or not utils.depends_on(current, var):
+            continue
+        rational = rationals[id(current)]
+        if rational is None:
+            stack.extend(utils.get_children(current))
+        elif not utils.is_var(current):
+            derivative = from_rational(rational_deriv(rational), var, form)
+            cache[id(current)] = (current, derivative)
+    return deriv(node, var, cache)
+
+
+def _to_rational(node: Node, var: Var,
+                 children: list[typing.Optional[Rational]]) -> typing.Optional[Rational]:
+    one: Poly = {0: Fraction(1)}
+
+    if isinstance(node, Num):
+        value = Fraction(node.value)
+        return ({0: value} if value else {}), one
+
+    if isinstance(node, Var):
+        return ({1: Fraction(1)}, one) if utils.same_var(node, var) else None
+
+    if any(child is None for child in children):
+        return None
+    args = typing.cast(list[Rational], children)
+
+    if isinstance(node, UnaryOp):
+        if utils.is_prefix_sign(node):
+            num, den = args[0]
+            return (poly_scale(num, Fraction(-1)) if node.op.type == MINUS else num), den
+        return None
+
+    if utils.is_sum(node):
+        return rational_add(args[0], args[1])
+
+    if utils.is_substr(node):
+        return rational_add(args[0], args[1], -1)
+
+    if utils.is_prod(node):
+        return rational_mul(args[0], args[1])
+
+    if utils.is_div(node):
+        return rational_div(args[0], args[1])
+
+    return rational_pow(args[0], args[1])
+
+
+def _reduce(num: Poly, den: Poly) -> Rational:
+    '''Divides out constant denominators and common powers of the variable'''
+    if not num:
+        return {}, {0: Fraction(1)}
+    if is_constant(den):
+        return poly_scale(num, 1 / den[0]), {0: Fraction(1)}
+    shift = min(min(num), min(den))
+    if shift:
+        num = {k - shift: c for k, c in num.items()}
+        den = {k - shift: c for k, c in den.items()}
+    return num, den
+
+
+def _coeff(c: Fraction) -> Node:
+    if c.denominator == 1:
+        return Num(Token(INTEGER, int(c)))
+    return utils.make_div(Num(Token(INTEGER, c.numerator)),
+                          Num(Token(INTEGER, c.denominator)))
+
+
+def _monomial(var: Var, k: int) -> Node:
+    return utils.make_power(var, Num(Token(INTEGER, k)))
+
+
+def _term(c: Fraction, var: Var, k: int) -> Node:
+    return utils.make_prod(_coeff(c), _monomial(var, k))
@@ -15,30 +15,45 @@ from derivative_calculator.tokenizer import Token, INTEGER, MINUS
 import derivative_calculator.utils as utils
 
 Node = typing.Union[UnaryOp, BinOp, Num, Var]
+Cache = typing.Optional[dict[int, tuple[Node, Node]]]
 
 
-def deriv(node: Node, var: Var) -> Node:
-    if utils.is_number(node):
+def deriv(node: Node, var: Var, cache: Cache = None) -> Node:
+    '''
+    Returns the derivative of node respect to var. The input is
+    normalized first, which costs nothing when it already is, so
+    the rules below only see simplified trees. If a cache dict is
+    given, the derivatives of visited subtrees are stored in it
+    together with the subtrees, keyed by node id, and reused when
+    the same node object is reached again. Subtrees in which var
+    does not occur are recognized from their free variable bitset
+    and return zero without being visited.
+    '''
+    node = utils.normalize(node)
+    if not utils.depends_on(node, var):
         return Num(Token(INTEGER, 0))
+    if cache is None:
+        return _deriv(node, var, cache)
+    key = id(node)
+    if key not in cache:
+        cache[key] = (node, _deriv(node, var, cache))
+    return cache[key][1]
 
+
+def _deriv(node: Node, var: Var, cache: Cache) -> Node:
+    # node depends on var, so a leaf can only be var itself
     if utils.is_var(node):
-        if utils.same_var(node, var):
-            return Num(Token(INTEGER, 1))
-        return Num(Token(INTEGER, 0))
+        return Num(Token(INTEGER, 1))
 
     if isinstance(node, UnaryOp):
         if utils.is_prefix_sign(node):
-            simpl_node: UnaryOp | Num = utils.simplifyPrefixSign(node)
-            if isinstance(simpl_node, Num):
-                return Num(Token(INTEGER, 0))
-            else:
-                return UnaryOp(simpl_node.token, deriv(simpl_node.expr, var))
+            return utils.make_sign(node.op, deriv(node.expr, var, cache))
 
         if utils.is_func(node):
             if node.value == 'exp':
                 return utils.make_prod(
                     node,
-                    deriv(node.expr, var)
+                    deriv(node.expr, var, cache)
                 )
 
             if node.value == 'log':
@@ -47,7 +62,7 @@ def deriv(node: Node, var: Var) -> Node:
                         Num(Token(INTEGER, 1)),
                         node.expr
                     ),
-                    deriv(node.expr, var)
+                    deriv(node.expr, var, cache)
                 )
 
             if node.value == 'sin':
@@ -56,19 +71,19 @@ def deriv(node: Node, var: Var) -> Node:
                         func='cos',
                         arg=node.expr
                     ),
-                    deriv(node.expr, var)
+                    deriv(node.expr, var, cache)
                 )
 
             if node.value == 'cos':
                 return utils.make_prod(
-                    UnaryOp(
+                    utils.make_sign(
                         Token(MINUS, '-'),
                         utils.make_func(
                             func='sin',
                             arg=node.expr
                             )
                         ),
-                    deriv(node.expr, var)
+                    deriv(node.expr, var, cache)
                 )
 
             if node.value == 'tan':
@@ -80,22 +95,22 @@ def deriv(node: Node, var: Var) -> Node:
                             ),
                             Num(Token(INTEGER, 2))
                         ),
-                        deriv(node.expr, var)
+                        deriv(node.expr, var, cache)
                     )
 
             if node.value == 'cosec':
                 return utils.make_prod(
                     utils.make_prod(
-                        UnaryOp(
-                            op=Token(MINUS, '-'),
-                            expr=node
+                        utils.make_sign(
+                            Token(MINUS, '-'),
+                            node
                         ),
                         utils.make_func(
                             func='cot',
                             arg=node.expr
                         )
                     ),
-                    deriv(node.expr, var)
+                    deriv(node.expr, var, cache)
                 )
 
             if node.value == 'sec':
@@ -107,14 +122,14 @@ def deriv(node: Node, var: Var) -> Node:
                             arg=node.expr
                         )
                     ),
-                    deriv(node.expr, var)
+                    deriv(node.expr, var, cache)
                 )
 
             if node.value == 'cot':
                 return utils.make_prod(
-                    UnaryOp(
-                        op=Token(MINUS, '-'),
-                        expr=utils.make_power(
+                    utils.make_sign(
+                        Token(MINUS, '-'),
+                        utils.make_power(
                             utils.make_func(
                                 func='cosec',
                                 arg=node.expr
@@ -122,44 +137,55 @@ def deriv(node: Node, var: Var) -> Node:
                             Num(Token(INTEGER, 2))
                             )
                     ),
-                    deriv(node.expr, var)
+                    deriv(node.expr, var, cache)
                 )
 
     if isinstance(node, BinOp):
         if utils.is_sum(node):
             return utils.make_sum(
-                deriv(node.left, var),
-                deriv(node.right, var)
+                deriv(node.left, var, cache),
+                deriv(node.right, var, cache)
             )
 
         if utils.is_substr(node):
             return utils.make_substr(
-                deriv(node.left, var),
-                deriv(node.right, var)
+                deriv(node.left, var, cache),
+                deriv(node.right, var, cache)
             )
 
         if utils.is_prod(node):
+            # constant factor rules
+            if not utils.depends_on(node.left, var):
+                return utils.make_prod(node.left, deriv(node.right, var, cache))
+
+            if not utils.depends_on(node.right, var):
+                return utils.make_prod(deriv(node.left, var, cache), node.right)
+
             return utils.make_sum(
                 utils.make_prod(
                     node.left,
-                    deriv(node.right, var)
+                    deriv(node.right, var, cache)
                 ),
                 utils.make_prod(
-                    deriv(node.left, var),
+                    deriv(node.left, var, cache),
                     node.right
                 )
             )
 
         if utils.is_div(node):
+            # constant denominator rule
+            if not utils.depends_on(node.right, var):
+                return utils.make_div(deriv(node.left, var, cache), node.right)
+
             return utils.make_div(
                 utils.make_substr(
                     utils.make_prod(
                         node.right,
-                        deriv(node.left, var)
+                        deriv(node.left, var, cache)
                     ),
                     utils.make_prod(
                         node.left,
-                        deriv(node.right, var)
+                        deriv(node.right, var, cache)
                     )
                 ),
                 utils.make_power(
@@ -172,6 +198,35 @@ def deriv(node: Node, var: Var) -> Node:
             base: Node = node.left
             exponent: Node = node.right
 
+            # constant exponent rule
+            if not utils.depends_on(exponent, var):
+                return utils.make_prod(
+                    utils.make_prod(
+                        exponent,
+                        utils.make_power(
+                            base,
+                            utils.make_substr(
+                                exponent,
+                                Num(Token(INTEGER, 1))
+                            )
+                        )
+                    ),
+                    deriv(base, var, cache)
+                )
+
+            # constant base rule
+            if not utils.depends_on(base, var):
+                return utils.make_prod(
+                    utils.make_prod(
+                        node,
+                        utils.make_func(
+                            'log',
+                            base
+                        )
+                    ),
+                    deriv(exponent, var, cache)
+                )
+
             return utils.make_sum(
                 utils.make_prod(
                         utils.make_prod(
@@ -184,7 +239,7 @@ def deriv(node: Node, var: Var) -> Node:
                                 )
                             )
                         ),
-                        deriv(base, var)
+                        deriv(base, var, cache)
                     ),
                 utils.make_prod(
                         utils.make_prod(
@@ -194,7 +249,7 @@ def deriv(node: Node, var: Var) -> Node:
                                 base
                                 )
                         ),
-                        deriv(exponent, var)
+                        deriv(exponent, var, cache)
                     )
                 )
 
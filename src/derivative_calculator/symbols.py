@@ -0,0 +1,31 @@
+'''
+Symbol table for variable names. Every variable name is interned
+to a small integer id the first time it is seen, so variables are
+compared and indexed by id instead of by string.
+'''
+
+
+class SymbolTable:
+    def __init__(self) -> None:
+        self.ids: dict[str, int] = {}
+        self.names: list[str] = []
+
+    def intern(self, name: str) -> int:
+        '''Returns the id of name, assigning the next free id to new names'''
+        if name not in self.ids:
+            self.ids[name] = len(self.names)
+            self.names.append(name)
+        return self.ids[name]
+
+    def name(self, id: int) -> str:
+        return self.names[id]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.ids
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+
+# table shared by the parser, the differentiation tool and the evaluators
+symbols = SymbolTable()
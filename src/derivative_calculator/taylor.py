@@ -0,0 +1,317 @@
+'''
+Truncated Taylor expansion of a parsed math function.
+Instead of differentiating the tree order times, the coefficients
+of a truncated power series are propagated through the abstract
+syntax tree in a single depth first pass, using the recurrences for
+products, quotients and the elementary functions. The cost grows
+with the square of the order and linearly with the size of the tree.
+Main program is taylor.
+
+Power series recurrences: https://en.wikipedia.org/wiki/Formal_power_series
+'''
+
+import math
+import typing
+from derivative_calculator.math_parser import Num, Var, UnaryOp, BinOp
+from derivative_calculator.tokenizer import Token, INTEGER, MINUS
+from derivative_calculator.symbols import symbols
+import derivative_calculator.utils as utils
+
+Node = typing.Union[UnaryOp, BinOp, Num, Var]
+Coeff = typing.Any
+Series = list[Coeff]
+
+
+class Ops(typing.Protocol):
+    '''Coefficient arithmetic the series recurrences are written against'''
+    def const(self, value: int) -> Coeff: ...
+
+    def var(self, node: Var) -> Coeff: ...
+
+    def is_zero(self, x: Coeff) -> bool: ...
+
+    def is_integer(self, x: Coeff) -> bool: ...
+
+    def add(self, x: Coeff, y: Coeff) -> Coeff: ...
+
+    def sub(self, x: Coeff, y: Coeff) -> Coeff: ...
+
+    def mul(self, x: Coeff, y: Coeff) -> Coeff: ...
+
+    def div(self, x: Coeff, y: Coeff) -> Coeff: ...
+
+    def power(self, x: Coeff, y: Coeff) -> Coeff: ...
+
+    def func(self, name: str, x: Coeff) -> Coeff: ...
+
+
+class NumericOps:
+    '''Coefficient arithmetic on floats'''
+    def __init__(self, env: dict[str, float]) -> None:
+        self.env = {symbols.intern(name): value for name, value in env.items()}
+
+    def const(self, value: float) -> float:
+        return value
+
+    def var(self, node: Var) -> float:
+        if node.id not in self.env:
+            raise Exception('Missing value for variable %s' % node.value)
+        return self.env[node.id]
+
+    def is_zero(self, x: float) -> bool:
+        return x == 0
+
+    def is_integer(self, x: float) -> bool:
+        return float(x).is_integer()
+
+    def add(self, x: float, y: float) -> float:
+        return x + y
+
+    def sub(self, x: float, y: float) -> float:
+        return x - y
+
+    def mul(self, x: float, y: float) -> float:
+        return x * y
+
+    def div(self, x: float, y: float) -> float:
+        if y == 0:
+            raise Exception('Error: division by zero')
+        return x / y
+
+    def power(self, x: float, y: float) -> float:
+        return typing.cast(float, x ** y)
+
+    def func(self, name: str, x: float) -> float:
+        return typing.cast(float, getattr(math, name)(x))
+
+
+class SymbolicOps:
+    '''Coefficient arithmetic on abstract syntax trees'''
+    def const(self, value: int) -> Node:
+        return Num(Token(INTEGER, value))
+
+    def var(self, node: Var) -> Node:
+        return node
+
+    def is_zero(self, x: Node) -> bool:
+        return utils.is_zero(x)
+
+    def is_integer(self, x: Node) -> bool:
+        return isinstance(x, Num) and isinstance(x.value, int)
+
+    def add(self, x: Node, y: Node) -> Node:
+        return utils.make_sum(x, y)
+
+    def sub(self, x: Node, y: Node) -> Node:
+        return utils.make_substr(x, y)
+
+    def mul(self, x: Node, y: Node) -> Node:
+        return utils.make_prod(x, y)
+
+    def div(self, x: Node, y: Node) -> Node:
+        return utils.make_div(x, y)
+
+    def power(self, x: Node, y: Node) -> Node:
+        return utils.make_power(x, y)
+
+    def func(self, name: str, x: Node) -> Node:
+        return utils.make_func(name, x)
+
+
+def series_mul(ops: Ops, a: Series, b: Series) -> Series:
+    return [
+        _total(ops, [ops.mul(a[j], b[k - j]) for j in range(k + 1)])
+        for k in range(len(a))
+    ]
+
+
+def series_div(ops: Ops, a: Series, b: Series) -> Series:
+    if ops.is_zero(b[0]):
+        raise Exception('Error: division by a series with zero constant term')
+    c: Series = []
+    for k in range(len(a)):
+        acc = _total(ops, [ops.mul(c[j], b[k - j]) for j in range(k)])
+        c.append(ops.div(ops.sub(a[k], acc), b[0]))
+    return c
+
+
+def series_exp(ops: Ops, a: Series) -> Series:
+    '''b = exp(a) satisfies b' = a'b'''
+    b: Series = [ops.func('exp', a[0])]
+    for k in range(1, len(a)):
+        acc = _total(ops, [ops.mul(ops.mul(ops.const(j), a[j]), b[k - j])
+                           for j in range(1, k + 1)])
+        b.append(ops.div(acc, ops.const(k)))
+    return b
+
+
+def series_log(ops: Ops, a: Series) -> Series:
+    '''b = log(a) satisfies ab' = a\''''
+    b: Series = [ops.func('log', a[0])]
+    for k in range(1, len(a)):
+        acc = _total(ops, [ops.mul(ops.mul(ops.const(j), b[j]), a[k - j])
+                           for j in range(1, k)])
+        b.append(ops.div(ops.sub(ops.mul(ops.const(k), a[k]), acc),
+                         ops.mul(ops.const(k), a[0])))
+    return b
+
+
+def series_sin_cos(ops: Ops, a: Series) -> tuple[Series, Series]:
+    '''s = sin(a) and c = cos(a) satisfy s' = ca' and c' = -sa\''''
+    s: Series = [ops.func('sin', a[0])]
+    c: Series = [ops.func('cos', a[0])]
+    for k in range(1, len(a)):
+        s_acc = _total(ops, [ops.mul(ops.mul(ops.const(j), a[j]), c[k - j])
+                             for j in range(1, k + 1)])
+        c_acc = _total(ops, [ops.mul(ops.mul(ops.const(j), a[j]), s[k - j])
+                             for j in range(1, k + 1)])
+        s.append(ops.div(s_acc, ops.const(k)))
+        c.append(ops.sub(ops.const(0), ops.div(c_acc, ops.const(k))))
+    return s, c
+
+
+def series_power(ops: Ops, a: Series, b: Series) -> Series:
+    if not all(ops.is_zero(coeff) for coeff in b[1:]):
+        return series_exp(ops, series_mul(ops, b, series_log(ops, a)))
+
+    p = b[0]
+    if ops.is_integer(p):
+        n = int(p.value if isinstance(p, Num) else p)
+        result = _series_int_power(ops, a, abs(n))
+        if n < 0:
+            return series_div(ops, _constant(ops, 1, len(a)), result)
+        return result
+
+    zeros = [ops.const(0)] * (len(a) - 1)
+    if all(ops.is_zero(coeff) for coeff in a[1:]):
+        # a constant base, which may be zero where the recurrence divides by it
+        return [ops.power(a[0], p)] + zeros
+
+    # c = a**p satisfies ac' = pca'
+    c: Series = [ops.power(a[0], p)]
+    for k in range(1, len(a)):
+        acc = _total(ops, [
+            ops.mul(ops.mul(ops.sub(ops.mul(p, ops.const(j)), ops.const(k - j)), a[j]),
+                    c[k - j])
+            for j in range(1, k + 1)
+        ])
+        c.append(ops.div(acc, ops.mul(ops.const(k), a[0])))
+    return c
+
+
+def taylor(node: Node, var: Var, point: typing.Union[float, Node], order: int,
+           env: typing.Optional[dict[str, float]] = None,
+           symbolic: bool = False) -> Series:
+    '''
+    Returns the Taylor coefficients f(point), f'(point), ...,
+    f^(order)(point)/order! of the function represented by node,
+    expanded respect to var. Coefficients are floats, with the other
+    variables taken from env, or abstract syntax trees in the other
+    variables if symbolic is set.
+    '''
+    if order < 0:
+        raise Exception('Error: the order must be a non-negative integer')
+    ops: Ops = SymbolicOps() if symbolic else NumericOps(env or {})
+    if symbolic and not isinstance(point, (Num, Var, UnaryOp, BinOp)):
+        point = Num(Token(INTEGER, point))
+    center: Series = [point, ops.const(1)] + [ops.const(0)] * (order - 1)
+    return _series(node, var, center[:order + 1], ops, {})
+
+
+def _series(node: Node, var: Var, center: Series, ops: Ops,
+            memo: dict[int, Series]) -> Series:
+    key = id(node)
+    if key not in memo:
+        memo[key] = _series_node(node, var, center, ops, memo)
+    return memo[key]
+
+
+def _series_node(node: Node, var: Var, center: Series, ops: Ops,
+                 memo: dict[int, Series]) -> Series:
+    order = len(center)
+
+    if isinstance(node, Num):
+        return _constant(ops, node.value, order)
+
+    if isinstance(node, Var):
+        if utils.same_var(node, var):
+            return center
+        return [ops.var(node)] + [ops.const(0)] * (order - 1)
+
+    if isinstance(node, UnaryOp):
+        arg = _series(node.expr, var, center, ops, memo)
+
+        if utils.is_prefix_sign(node):
+            if node.op.type == MINUS:
+                return [ops.sub(ops.const(0), coeff) for coeff in arg]
+            return arg
+
+        if node.value == 'exp':
+            return series_exp(ops, arg)
+
+        if node.value == 'log':
+            return series_log(ops, arg)
+
+        sin, cos = series_sin_cos(ops, arg)
+
+        if node.value == 'sin':
+            return sin
+
+        if node.value == 'cos':
+            return cos
+
+        if node.value == 'tan':
+            return series_div(ops, sin, cos)
+
+        if node.value == 'cosec':
+            return series_div(ops, _constant(ops, 1, order), sin)
+
+        if node.value == 'sec':
+            return series_div(ops, _constant(ops, 1, order), cos)
+
+        if node.value == 'cot':
+            return series_div(ops, cos, sin)
+
+    if isinstance(node, BinOp):
+        left = _series(node.left, var, center, ops, memo)
+        right = _series(node.right, var, center, ops, memo)
+
+        if utils.is_sum(node):
+            return [ops.add(x, y) for x, y in zip(left, right)]
+
+        if utils.is_substr(node):
+            return [ops.sub(x, y) for x, y in zip(left, right)]
+
+        if utils.is_prod(node):
+            return series_mul(ops, left, right)
+
+        if utils.is_div(node):
+            return series_div(ops, left, right)
+
+        if utils.is_pow(node):
+            return series_power(ops, left, right)
+
+    raise Exception('Could not find any tokens matching input')
+
+
+def _series_int_power(ops: Ops, a: Series, n: int) -> Series:
+    '''Binary exponentiation of a series to a non-negative integer power'''
+    result = _constant(ops, 1, len(a))
+    while n:
+        if n & 1:
+            result = series_mul(ops, result, a)
+        n >>= 1
+        if n:
+            a = series_mul(ops, a, a)
+    return result
+
+
+def _constant(ops: Ops, value: int, order: int) -> Series:
+    return [ops.const(value)] + [ops.const(0)] * (order - 1)
+
+
+def _total(ops: Ops, terms: Series) -> Coeff:
+    result = ops.const(0)
+    for term in terms:
+        result = ops.add(result, term)
+    return result
@@ -3,6 +3,7 @@ Tokenizer implementation.
 Tokenizer.token_iter is the main program.
 '''
 
+import mmap
 import typing
 
 
@@ -20,22 +21,33 @@ class Token:
         self.value = value
 
 
+# bytes-like inputs are read one ascii character at a time,
+# so the tokenizer never copies them into a str
+Text = typing.Union[str, bytes, bytearray, mmap.mmap]
+
+
 class Tokenizer:
-    def __init__(self, text: str) -> None:
+    def __init__(self, text: Text, start: int = 0,
+                 end: typing.Optional[int] = None) -> None:
+        """Tokenize text[start:end], the whole text by default."""
         self.text = text
-        self.pos = 0
-        self.current_char: typing.Optional[str] = self.text[self.pos]
+        self.pos = start
+        self.end = len(text) if end is None else end
+        self.current_char: typing.Optional[str] = self.char_at(self.pos)
 
     def error(self) -> None:
         raise Exception('Invalid character')
 
+    def char_at(self, pos: int) -> typing.Optional[str]:
+        if pos >= self.end:
+            return None
+        char = self.text[pos]
+        return char if isinstance(char, str) else chr(char)
+
     def advance(self) -> None:
         """Advance pos pointer and set current_char variable."""
         self.pos += 1
-        if self.pos > len(self.text) - 1:
-            self.current_char = None
-        else:
-            self.current_char = self.text[self.pos]
+        self.current_char = self.char_at(self.pos)
 
     def skip_whitespace(self) -> None:
         while self.current_char is not None and self.current_char.isspace():
@@ -49,21 +61,20 @@ class Tokenizer:
             self.advance()
         return int(result)
 
-    def handle_alpha_seq(self) -> tuple[str, str]:  # type: ignore[return]
-        """Determine whether or not our sequence of alpha
-        characters is a variable or a valid function."""
+    def handle_alpha_seq(self) -> tuple[str, str]:
+        """Determine whether our identifier, an alpha character
+        followed by alphanumeric characters or underscores, is a
+        valid function or a variable."""
         result = ''
-        while self.current_char is not None and self.current_char.isalpha():
+        while self.current_char is not None and (
+                self.current_char.isalnum() or self.current_char == '_'):
             result += self.current_char
             self.advance()
 
-        if len(result) == 1:
-            return VAR, result
-
         if result in valid_functions:
             return FUNC, result
 
-        self.error()
+        return VAR, result
 
     def handle_asterisk(self) -> tuple[str, str]:  # type: ignore[return]
         """Determine whether or not our asterisk is followed
@@ -1,11 +1,15 @@
 '''
 Collection of utils used in the symbolic
 differentiation tool and in the interpreter.
+The make_* functions are the simplification rules of the
+package: they are applied once, when nodes are built, and
+normalize applies them to trees built by other means.
 '''
 
 import typing
 from derivative_calculator.math_parser import Num, Var, UnaryOp, BinOp
 from derivative_calculator.tokenizer import Token, INTEGER, PLUS, MINUS, MUL, DIV, POW, FUNC
+from derivative_calculator.symbols import symbols
 
 Node = typing.Union[UnaryOp, BinOp, Num, Var]
 
@@ -30,9 +34,22 @@ def is_var(node: Node) -> bool:
     return isinstance(node, Var)
 
 
+def depends_on(node: Node, var: Var) -> bool:
+    '''Whether var occurs in node, read from its free variable bitset'''
+    return bool(node.free_vars >> var.id & 1)
+
+
+def free_var_names(node: Node) -> list[str]:
+    '''Names of the variables in node, in alphabetical order'''
+    free_vars = node.free_vars
+    return sorted(
+        symbols.name(i) for i in range(free_vars.bit_length()) if free_vars >> i & 1
+    )
+
+
 def same_var(x: Node, y: Node) -> bool:
     return (isinstance(x, Var)
-            and isinstance(y, Var)) and x.value == y.value
+            and isinstance(y, Var)) and x.id == y.id
 
 
 def is_prefix_sign(node: Node) -> bool:
@@ -87,12 +104,27 @@ def simplifyPrefixSign(node: UnaryOp) -> typing.Union[Num, UnaryOp]:
         return UnaryOp(curr_token, node)
 
 
-def make_sum(x: Node, y: Node) -> Node:
-    if isinstance(x, UnaryOp) and x.op.type in (PLUS, MINUS):
-        x = simplifyPrefixSign(x)
+def make_sign(sign: Token, x: Node) -> Node:
+    '''
+    Applies a prefix sign to x, collapsing chains of prefix signs
+    into a single minus sign or none, and negating numbers
+    '''
+    negative = sign.type == MINUS
+    while isinstance(x, UnaryOp) and is_prefix_sign(x):
+        negative ^= x.op.type == MINUS
+        x = x.expr
+
+    if not negative:
+        return x
+
+    if isinstance(x, Num):
+        return Num(Token(INTEGER, -x.value))
+
+    return _mark(UnaryOp(Token(MINUS, '-'), x), x.normalized)
+
 
-    if isinstance(y, UnaryOp) and y.op.type in (PLUS, MINUS):
-        y = simplifyPrefixSign(y)
+def make_sum(x: Node, y: Node) -> Node:
+    x, y = _simplify_signs(x), _simplify_signs(y)
 
     if isinstance(x, Num) and isinstance(y, Num):
         return Num(Token(INTEGER, x.value + y.value))
@@ -102,34 +134,33 @@ def make_sum(x: Node, y: Node) -> Node:
 
     if isinstance(y, Num) and y.value == 0:
         return x
-    return BinOp(x, Token(PLUS, '+'), y)
 
+    if isinstance(y, Num) and y.value < 0 or _is_negated(y):
+        return make_substr(x, make_sign(Token(MINUS, '-'), y))
 
-def make_substr(x: Node, y: Node) -> Node:
-    if isinstance(x, UnaryOp) and x.op.type in (PLUS, MINUS):
-        x = simplifyPrefixSign(x)
+    return _mark(BinOp(x, Token(PLUS, '+'), y), x.normalized and y.normalized)
 
-    if isinstance(y, UnaryOp) and y.op.type in (PLUS, MINUS):
-        y = simplifyPrefixSign(y)
+
+def make_substr(x: Node, y: Node) -> Node:
+    x, y = _simplify_signs(x), _simplify_signs(y)
 
     if isinstance(x, Num) and isinstance(y, Num):
         return Num(Token(INTEGER, x.value - y.value))
 
     if isinstance(x, Num) and x.value == 0:
-        return UnaryOp(op=Token(MINUS, '-'), expr=y)
+        return make_sign(Token(MINUS, '-'), y)
 
     if isinstance(y, Num) and y.value == 0:
         return x
 
-    return BinOp(x, Token(MINUS, '-'), y)
+    if isinstance(y, Num) and y.value < 0 or _is_negated(y):
+        return make_sum(x, make_sign(Token(MINUS, '-'), y))
 
+    return _mark(BinOp(x, Token(MINUS, '-'), y), x.normalized and y.normalized)
 
-def make_prod(x: Node, y: Node) -> Node:
-    if isinstance(x, UnaryOp) and x.op.type in (PLUS, MINUS):
-        x = simplifyPrefixSign(x)
 
-    if isinstance(y, UnaryOp) and y.op.type in (PLUS, MINUS):
-        y = simplifyPrefixSign(y)
+def make_prod(x: Node, y: Node) -> Node:
+    x, y = _simplify_signs(x), _simplify_signs(y)
 
     if isinstance(x, Num) and isinstance(y, Num):
         return Num(Token(INTEGER, x.value * y.value))
@@ -141,18 +172,14 @@ def make_prod(x: Node, y: Node) -> Node:
     if isinstance(x, Num) and x.value == 1:
         return y
 
-    if isinstance(y, Num) and y.value == 0:
+    if isinstance(y, Num) and y.value == 1:
         return x
 
-    return BinOp(x, Token(MUL, '*'), y)
+    return _mark(BinOp(x, Token(MUL, '*'), y), x.normalized and y.normalized)
 
 
 def make_div(x: Node, y: Node) -> Node:
-    if isinstance(x, UnaryOp) and x.op.type in (PLUS, MINUS):
-        x = simplifyPrefixSign(x)
-
-    if isinstance(y, UnaryOp) and y.op.type in (PLUS, MINUS):
-        y = simplifyPrefixSign(y)
+    x, y = _simplify_signs(x), _simplify_signs(y)
 
     if isinstance(y, Num) and y.value == 0:
         raise Exception('Error: division by zero')
@@ -163,15 +190,11 @@ def make_div(x: Node, y: Node) -> Node:
     if isinstance(y, Num) and y.value == 1:
         return x
 
-    return BinOp(x, Token(DIV, '/'), y)
+    return _mark(BinOp(x, Token(DIV, '/'), y), x.normalized and y.normalized)
 
 
 def make_power(x: Node, y: Node) -> Node:
-    if isinstance(x, UnaryOp) and x.op.type in (PLUS, MINUS):
-        x = simplifyPrefixSign(x)
-
-    if isinstance(y, UnaryOp) and y.op.type in (PLUS, MINUS):
-        y = simplifyPrefixSign(y)
+    x, y = _simplify_signs(x), _simplify_signs(y)
 
     if isinstance(x, Num) and isinstance(y, Num):
         return Num(Token(INTEGER, x.value ** y.value))
@@ -186,8 +209,96 @@ def make_power(x: Node, y: Node) -> Node:
     if isinstance(y, Num) and y.value == 1:
         return x
 
-    return BinOp(x, Token(POW, '**'), y)
+    return _mark(BinOp(x, Token(POW, '**'), y), x.normalized and y.normalized)
 
 
 def make_func(func: str, arg: Node) -> UnaryOp:
-    return UnaryOp(Token(FUNC, func), arg)
+    node = UnaryOp(Token(FUNC, func), _simplify_signs(arg))
+    node.normalized = node.expr.normalized
+    return node
+
+
+make_binOp = {
+    PLUS: make_sum, MINUS: make_substr, MUL: make_prod, DIV: make_div, POW: make_power
+}
+
+
+def normalize(node: Node) -> Node:
+    '''
+    Rewrites node with the same rules the make_* functions apply
+    at construction time and marks every node of the result as
+    normalized. Children are normalized before their parent, so a
+    single bottom-up pass reaches a fixed point, and subtrees that
+    are already marked are returned as they are. Nodes that no rule
+    changes are kept, marked in place, rather than copied. The walk
+    uses an explicit stack, so long chains of sums or products do
+    not hit the recursion limit.
+    '''
+    if node.normalized:
+        return node
+
+    results: dict[int, Node] = {}
+    stack: list[tuple[Node, bool]] = [(node, False)]
+    while stack:
+        current, expanded = stack.pop()
+        if id(current) in results:
+            continue
+        children = get_children(current)
+        if not expanded:
+            stack.append((current, True))
+            stack.extend((child, False) for child in children if not child.normalized)
+            continue
+        results[id(current)] = _normalize_node(
+            current, [results.get(id(child), child) for child in children])
+
+    return results[id(node)]
+
+
+def _normalize_node(node: Node, children: list[Node]) -> Node:
+    '''Applies the construction rule of node to its normalized children'''
+    result: Node
+    if isinstance(node, UnaryOp):
+        expr = children[0]
+        if is_func(node):
+            result = make_func(node.value, expr)
+        else:
+            result = make_sign(node.op, expr)
+        if isinstance(result, UnaryOp) and result.expr is node.expr and (
+                result.op.type == node.op.type):
+            node.normalized = True
+            return node
+        return result
+
+    if isinstance(node, BinOp):
+        left, right = children
+        result = make_binOp[node.op.type](left, right)
+        if (isinstance(result, BinOp) and result.left is node.left and
+                result.right is node.right and result.op.type == node.op.type):
+            node.normalized = True
+            return node
+        return result
+
+    return node
+
+
+def get_children(node: Node) -> list[Node]:
+    if isinstance(node, UnaryOp):
+        return [node.expr]
+    if isinstance(node, BinOp):
+        return [node.left, node.right]
+    return []
+
+
+def _simplify_signs(x: Node) -> Node:
+    if not x.normalized and is_prefix_sign(x):
+        return make_sign(Token(PLUS, '+'), x)
+    return x
+
+
+def _is_negated(node: Node) -> bool:
+    return isinstance(node, UnaryOp) and node.op.type == MINUS
+
+
+def _mark(node: BinOp | UnaryOp, normalized: bool) -> Node:
+    node.normalized = normalized
+    return node
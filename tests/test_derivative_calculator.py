@@ -1,8 +1,28 @@
+import concurrent.futures
+import math
 import pytest
 import typing
 from derivative_calculator.math_parser import Var, Num, BinOp, UnaryOp, Parser
 from derivative_calculator.interpreter import Interpreter
 from derivative_calculator.symb_diff_tool import deriv
+from derivative_calculator.incremental import IncrementalDeriv
+from derivative_calculator.taylor import taylor
+from derivative_calculator.forward_mode import (
+    forward_eval, forward_gradient, forward_eval_many
+)
+from derivative_calculator.codegen import export_derivatives
+from derivative_calculator.symbols import symbols
+import derivative_calculator.utils as utils
+from derivative_calculator.corpus import differentiate_corpus
+from derivative_calculator.parallel import parallel_deriv, split
+from derivative_calculator.metrics import subtree_sizes, measure
+from derivative_calculator.polynomial import poly_deriv, HORNER
+from derivative_calculator.batch import batch_deriv
+from derivative_calculator.kernels import compile_kernel
+from derivative_calculator.fingerprint import fingerprint, DerivativeCache
+from derivative_calculator.interface import Session
+from derivative_calculator.matrices import jacobian, hessian
+from derivative_calculator.lazy import lazy_deriv, materialize, LazyInterpreter
 from derivative_calculator.tokenizer import (
     Token,
     Tokenizer,
@@ -164,3 +184,404 @@ def test_derivatives(test_input: str, expected: str) -> None:
     result
     '''
     assert test_input == expected
+
+
+def test_incremental_deriv() -> None:
+    '''
+    Re-differentiating an edited expression must give the same
+    result as a fresh derivative while reusing the cached
+    derivatives of the unchanged subtrees
+    '''
+    inc = IncrementalDeriv('x')
+    first = inc.deriv('sin(x**2)*exp(x)+log(x)')
+    cached = len(inc.cache)
+    second = inc.deriv('sin(x**2)*exp(x)+cos(x)')
+    assert interpret_ast(first) == get_derivative('sin(x**2)*exp(x)+log(x)', 'x')
+    assert interpret_ast(second) == get_derivative('sin(x**2)*exp(x)+cos(x)', 'x')
+    # the edited term and the root replace the entries of the old ones
+    assert len(inc.cache) == cached
+    assert second.left is first.left
+    assert inc.parse('(x+1)*(x+1)').left is inc.parse('x+1')
+
+    inc = IncrementalDeriv('x')
+    terms = ['sin(x*%d)' % k for k in range(50)]
+    inc.deriv('+'.join(terms))
+    size = len(inc.interner)
+    for k in range(10):
+        # the term k of a left-deep sum of 50 terms is at this path
+        path = [0] * (49 - max(k, 1)) + [1 if k else 0]
+        terms[k] = 'cos(x**%d)' % (k + 2)
+        edited = inc.edit(path, terms[k])
+        assert interpret_ast(edited) == get_derivative('+'.join(terms), 'x')
+    assert len(inc.interner) <= size + 10
+
+
+def test_taylor() -> None:
+    '''
+    We compare the propagated series coefficients with known
+    expansions, both numerically and symbolically
+    '''
+    x = Var(Token(VAR, 'x'))
+    assert taylor(get_parsed_expr('(1+x)**3'), x, 0, 4) == [1, 3, 3, 1, 0]
+    coeffs = taylor(get_parsed_expr('tan(x)+exp(y*x)'), x, 0, 3, env={'y': 2})
+    assert coeffs == pytest.approx([1, 3, 2, 1 / 3 + 8 / 6])
+    a = Var(Token(VAR, 'a'))
+    sin_coeffs = taylor(get_parsed_expr('sin(x)'), x, a, 2, symbolic=True)
+    assert [interpret_ast(c) for c in sin_coeffs] == ['sin(a)', 'cos(a)', '(-sin(a))/2']
+    # a zero base is constant, so its non-integer power needs no recurrence
+    assert taylor(get_parsed_expr('0**y'), x, 0.7, 2, env={'y': 1.3}) == [0, 0, 0]
+    assert taylor(get_parsed_expr('(y-y)**y'), x, 0.7, 2, env={'y': 1.3}) == [0, 0, 0]
+
+
+def test_forward_mode() -> None:
+    '''
+    Dual number evaluation must agree with the values of the
+    symbolic derivatives at the same point
+    '''
+    x = Var(Token(VAR, 'x'))
+    value, slope = forward_eval(get_parsed_expr('x**3*sin(x)+y'), x, {'x': 2, 'y': 1})
+    assert value == pytest.approx(8 * math.sin(2) + 1)
+    assert slope == pytest.approx(12 * math.sin(2) + 8 * math.cos(2))
+    assert forward_eval(get_parsed_expr('x**x'), x, {'x': 2})[1] == pytest.approx(
+        4 * (math.log(2) + 1))
+    value, grad = forward_gradient(get_parsed_expr('sec(x)*y/cot(y)'), {'x': 1, 'y': 2})
+    assert value == pytest.approx(2 * math.tan(2) / math.cos(1))
+    assert grad == pytest.approx([2 * math.tan(2) * math.tan(1) / math.cos(1),
+                                  (math.tan(2) + 2 / math.cos(2) ** 2) / math.cos(1)])
+    assert forward_eval(get_parsed_expr('x**0'), x, {'x': 0}) == (1, 0)
+    assert forward_eval(get_parsed_expr('3'), x, {}) == (3, 0)
+    points = [{'x': k / 4, 'y': 2} for k in range(1, 6)]
+    expr = get_parsed_expr('log(x*y)*(x*y)**2')
+    assert forward_eval_many(expr, x, points) == [forward_eval(expr, x, p) for p in points]
+
+
+def test_export_derivatives(tmp_path: typing.Any) -> None:
+    '''
+    Generated modules must return the same partial derivatives as
+    forward mode, hoist repeated subexpressions and be reused from
+    the cache directory on the next export
+    '''
+    exprs = {'f': 'sin(x**2)*exp(x**2)+y*x', 'g': 'x/y'}
+    module = export_derivatives(exprs, ['x', 'y'], str(tmp_path))
+    assert module.ARGS == ('x', 'y')
+    _, grad = forward_gradient(get_parsed_expr(exprs['f']), {'x': 1.5, 'y': 2})
+    assert module.f(1.5, 2) == pytest.approx(tuple(grad))
+    assert module.g(1, 2) == pytest.approx((0.5, -0.25))
+    with open(module.__file__) as source:
+        assert source.read().count('(x ** 2)') == 1
+    assert export_derivatives(exprs, ['x', 'y'], str(tmp_path)).__file__ == module.__file__
+    assert len(list(tmp_path.glob('*.py'))) == 1
+
+    # keywords are renamed without clashing with the other variables
+    module = export_derivatives({'h': 'lambda*lambda_**2'}, ['lambda'], str(tmp_path))
+    assert module.ARGS == ('lambda', 'lambda_')
+    assert module.h(2, 3) == 9
+
+    # functions may not replace the names the generated module defines
+    for name in ['sin', 'cosec', 'ARGS']:
+        with pytest.raises(Exception, match='reserved'):
+            export_derivatives({name: 'x**2', 'f': 'cosec(x)'}, ['x'], str(tmp_path))
+    assert len(list(tmp_path.glob('*.py'))) == 2
+
+
+def test_multichar_variables() -> None:
+    '''
+    Identifiers longer than one letter are variables interned in
+    the symbol table, and distinct names get distinct ids
+    '''
+    assert get_derivative('theta**2*x1+sin(theta)', 'theta') == '2*theta*x1+cos(theta)'
+    assert get_derivative('x1*x2', 'x2') == 'x1'
+    assert get_derivative('x1*x2', 'x') == '0'
+    tree = get_parsed_expr('alpha_1*alpha_1')
+    assert isinstance(tree, BinOp)
+    left, right = tree.left, tree.right
+    assert isinstance(left, Var) and isinstance(right, Var)
+    assert left.id == right.id == symbols.intern('alpha_1')
+    assert symbols.name(left.id) == 'alpha_1'
+    assert Var(Token(VAR, 'beta')).id != left.id
+
+
+def test_normalize() -> None:
+    '''
+    Normalization applies the construction rules once and marks
+    the result, and the interpreter prints trees as they are
+    '''
+    raw = get_parsed_expr('0+x*1--y')
+    assert interpret_ast(raw) == '0+x*1--y'
+    normalized = utils.normalize(raw)
+    assert normalized.normalized
+    assert interpret_ast(normalized) == 'x+y'
+    assert utils.normalize(normalized) is normalized
+    unchanged = get_parsed_expr('sin(x)*y')
+    assert utils.normalize(unchanged) is unchanged
+    assert get_derivative('cot(x)', 'x') == '-(cosec(x)**2)'
+    assert get_derivative('--x**3', 'x') == '3*x**2'
+    # a folded negative base keeps the parentheses of the prefix sign
+    assert get_derivative('(-3)**x', 'x') == '(-3)**x*log(-3)'
+    assert get_derivative('(-2)**x*x', 'x') == '(-2)**x+(-2)**x*log(-2)*x'
+
+
+def test_free_vars() -> None:
+    '''
+    Every node carries the bitset of its variables, and deriv
+    skips the subtrees that do not contain the variable
+    '''
+    x, y = Var(Token(VAR, 'x')), Var(Token(VAR, 'y'))
+    tree = get_parsed_expr('sin(y**3)*x+exp(y)/x')
+    assert tree.free_vars == 1 << x.id | 1 << y.id
+    assert isinstance(tree, BinOp) and not utils.depends_on(tree.left.left, x)
+    cache: dict[int, tuple[Node, Node]] = {}
+    assert interpret_ast(deriv(tree, x, cache)) == 'sin(y**3)+(-exp(y))/(x**2)'
+    assert all(utils.depends_on(node, x) for node, _ in cache.values())
+    assert get_derivative('(x**2+x)/y', 'x') == '(2*x+1)/y'
+
+
+def test_differentiate_corpus(tmp_path: typing.Any) -> None:
+    '''
+    Lines of a memory-mapped file are differentiated in order, in
+    this process or in a pool, and a run resumes from the offset
+    carried by any result
+    '''
+    path = tmp_path / 'corpus.txt'
+    path.write_bytes(b'x**5\n\nsin(x)\r\nx*y\nexp(x)')
+    assert list(differentiate_corpus(str(path), 'x', workers=1, lines_per_range=2)) == [
+        (0, 5, '5*x**4', None), (2, 14, 'cos(x)', None), (3, 18, 'y', None),
+        (4, 24, 'exp(x)', None)]
+    assert list(differentiate_corpus(str(path), 'y', workers=2, lines_per_range=1)) == [
+        (0, 5, '0', None), (2, 14, '0', None), (3, 18, 'x', None), (4, 24, '0', None)]
+    assert (tmp_path / 'corpus.txt.idx').exists()
+    resumed = differentiate_corpus(str(path), 'x', workers=1, start_offset=14)
+    assert [line for line, _, _, _ in resumed] == [3, 4]
+
+    # a malformed line gives an error and the run goes on past it
+    path.write_bytes(b'x**2\nsin(x\nexp(x)\n')
+    results = list(differentiate_corpus(str(path), 'x', workers=1))
+    assert [(line, derivative) for line, _, derivative, _ in results] == [
+        (0, '2*x'), (1, None), (2, 'exp(x)')]
+    assert results[1][3] is not None
+    resumed = differentiate_corpus(str(path), 'x', workers=1, start_offset=results[1][1])
+    assert [line for line, _, _, _ in resumed] == [2]
+
+
+def test_parallel_deriv() -> None:
+    '''
+    Splitting a large expression into pieces differentiated by
+    workers must give the same tree as a sequential derivative
+    '''
+    x = Var(Token(VAR, 'x'))
+    expr = '+'.join('sin(%d*x)*x**%d-y*log(x+%d)' % (i, i, i) for i in range(1, 40))
+    expected = get_derivative('(%s)*exp(x)' % expr, 'x')
+    tree = get_parsed_expr('(%s)*exp(x)' % expr)
+    assert interpret_ast(parallel_deriv(tree, x, workers=2, threshold=20)) == expected
+    sizes = subtree_sizes(tree)
+    points, pieces = split(tree, x, sizes, 20)
+    assert points[0] is tree and all(sizes[id(piece)] <= 20 for piece in pieces)
+    chain = get_parsed_expr('+'.join('%d*x**%d' % (i, i) for i in range(1, 3000)))
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        chain_deriv = parallel_deriv(chain, x, threshold=100, executor=executor)
+    # the result is as deep as the input, so it is checked term by term
+    terms = []
+    while utils.is_sum(chain_deriv):
+        terms.append(chain_deriv.right)
+        chain_deriv = chain_deriv.left
+    terms.append(chain_deriv)
+    assert len(terms) == 2999
+    assert interpret_ast(terms[0]) == get_derivative('2999*x**2999', 'x')
+
+
+def test_poly_deriv() -> None:
+    '''
+    Polynomial and rational subtrees are differentiated as
+    coefficient maps and printed in expanded or Horner form
+    '''
+    x = Var(Token(VAR, 'x'))
+    tree = get_parsed_expr('(x+1)**3*(2*x-1)')
+    assert interpret_ast(poly_deriv(tree, x)) == '8*x**3+15*x**2+6*x-1'
+    assert interpret_ast(poly_deriv(tree, x, HORNER)) == '((8*x+15)*x+6)*x-1'
+    horner = poly_deriv(get_parsed_expr('x**5-x/2'), x, HORNER)
+    assert interpret_ast(horner) == '5*x**4-(1/2)'
+    rational = get_parsed_expr('(x**2+1)/(x-1)')
+    assert interpret_ast(poly_deriv(rational, x)) == '(x**2-2*x-1)/(x**2-2*x+1)'
+    mixed = get_parsed_expr('sin(x)*(x+1)**2+y*(x**3-x)')
+    assert interpret_ast(poly_deriv(mixed, x)) == (
+        'sin(x)*(2*x+2)+cos(x)*(x+1)**2+y*(3*x**2-1)')
+
+
+def test_metrics() -> None:
+    '''
+    Metrics report the size, depth and histograms of a tree, and
+    the batch scheduler returns derivatives in input order
+    '''
+    x = Var(Token(VAR, 'x'))
+    metrics = measure(get_parsed_expr('sin(x)*sin(x)+y**2'), x)
+    assert (metrics.node_count, metrics.depth) == (9, 4)
+    assert metrics.operators == {MUL: 1, PLUS: 1, POW: 1}
+    assert metrics.functions == {'sin': 2}
+    assert metrics.predicted_size > measure(get_parsed_expr('x*y'), x).predicted_size
+    assert measure(get_parsed_expr('y**2'), x).predicted_size == 1
+    exprs = ['x**2', '+'.join('sin(%d*x)' % i for i in range(1, 60)), 'y', 'exp(x)']
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        results = batch_deriv(exprs, 'x', split_threshold=50, piece_threshold=20,
+                              executor=executor)
+    assert [interpret_ast(result) for result in results] == [
+        get_derivative(expr, 'x') for expr in exprs]
+
+
+def test_compile_kernel() -> None:
+    '''
+    A fused kernel returns the function and its derivatives
+    together, matching the separately interpreted derivatives
+    '''
+    x = Var(Token(VAR, 'x'))
+    tree = get_parsed_expr('exp(sin(x)*y)+sec(x)')
+    kernel = compile_kernel(tree, x, order=2)
+    value, first, second = kernel(0.3, 1.5)
+    assert value == pytest.approx(math.exp(math.sin(0.3) * 1.5) + 1 / math.cos(0.3))
+    assert first == pytest.approx(forward_eval(tree, x, {'x': 0.3, 'y': 1.5})[1])
+    first_deriv = deriv(tree, x)
+    assert second == pytest.approx(forward_eval(first_deriv, x, {'x': 0.3, 'y': 1.5})[1])
+    assert compile_kernel(tree, x, order=0, args=['y', 'x'])(1.5, 0.3) == (value,)
+
+
+def test_compile_kernel_numpy() -> None:
+    '''
+    With numpy installed, kernels evaluate on arrays of points
+    '''
+    numpy = pytest.importorskip('numpy')
+    x = Var(Token(VAR, 'x'))
+    kernel = compile_kernel(get_parsed_expr('x*log(x)'), x, use_numpy=True)
+    points = numpy.array([1.0, 2.0, 3.0])
+    value, first = kernel(points)
+    assert value == pytest.approx(points * numpy.log(points))
+    assert first == pytest.approx(numpy.log(points) + 1)
+
+
+def test_fingerprint() -> None:
+    '''
+    Equivalent spellings share a fingerprint and a derivative cache
+    entry, and the optional canonical check only confirms reorderings
+    '''
+    def fp(expr: str) -> tuple[int, ...]:
+        return fingerprint(get_parsed_expr(expr))
+
+    assert fp('x*2') == fp('2*x')
+    assert fp('(x+1)**2') == fp('(1+x)**2') == fp('x**2+2*x+1')
+    assert fp('sin(x+1)/x**-1') == fp('x*sin(1+x)')
+    assert fp('x**(1/2)') == fp('x**(2/4)')
+    assert fp('x') != fp('y')
+    assert fp('sin(x)') != fp('cos(x)')
+    # constants and exponents that would wrap around the prime are kept exact
+    assert fp('x*2305843009213693951') != fp('0')
+    assert fp('x**2305843009213693950') != fp('1')
+    assert fp('x*2**61') != fp('x')
+    assert fp('2**100') != fp('2**39')
+    assert fp('2**61*x') == fp('x*(2**60+2**60)')
+
+    x = Var(Token(VAR, 'x'))
+    cache = DerivativeCache()
+    first = cache.deriv(get_parsed_expr('(x+1)**2'), x)
+    assert cache.deriv(get_parsed_expr('x**2+2*x+1'), x) is first
+    assert (cache.hits, cache.misses, len(cache)) == (1, 1, 1)
+
+    bounded = DerivativeCache(max_size=2)
+    for expr in ['x', 'x**2', 'x', 'x**3', 'x']:
+        bounded.deriv(get_parsed_expr(expr), x)
+    # x**2 was the least recently used input when x**3 came in
+    assert (bounded.hits, bounded.misses, len(bounded)) == (2, 3, 2)
+
+    confirmed = DerivativeCache(confirm=True)
+    confirmed.deriv(get_parsed_expr('x*2+y'), x)
+    confirmed.deriv(get_parsed_expr('y+2*x'), x)
+    confirmed.deriv(get_parsed_expr('y*1+2*x'), x)
+    confirmed.deriv(get_parsed_expr('x+x+y'), x)
+    assert (confirmed.hits, confirmed.misses) == (2, 2)
+
+
+def test_session() -> None:
+    '''
+    A session differentiates again, takes higher orders and evaluates
+    the last result, reusing its cache and compiled evaluators
+    '''
+    session = Session()
+    assert session.handle('x**3*y') == 'Derivative: 3*x**2*y'
+    assert session.handle(':again') == 'Derivative: 3*2*x*y'
+    assert session.handle(':order 3') == 'Derivative: 6*y'
+    assert session.handle(':eval x=2 y=1.5') == 'Value: 9.0'
+    assert session.handle(':eval x=2 y=1.5') == 'Value: 9.0'
+    assert len(session.kernels) == 1
+    assert session.cache.hits >= 1
+    assert session.handle(':eval x=2').startswith('Error: missing value for y')
+
+    assert session.handle(':var y') == 'Differentiating respect to y'
+    assert session.handle(':again') == 'Derivative: 6'
+    assert session.handle(':var sin').startswith('Error')
+    assert session.handle(':nope').startswith('Error: unknown command')
+    assert session.handle('x+') == 'Error: Invalid syntax'
+    assert session.handle(':') == 'Error: missing command, try :help'
+    assert session.handle(':order -1').startswith('Error: the order must be')
+
+    session.handle(':time on')
+    lines = session.handle('sin(y)').splitlines()
+    assert lines[0] == 'Derivative: cos(y)'
+    stages = [stage.split()[0] for stage in lines[1].split('  ')]
+    assert stages == ['parse', 'deriv', 'print']
+
+
+def test_jacobian_hessian() -> None:
+    '''
+    Matrices hold the partial derivatives, structural zeros are left
+    out of sparse results and mixed partials are shared
+    '''
+    def show(matrix: typing.Any) -> list[list[str]]:
+        return [[interpret_ast(entry) for entry in row] for row in matrix]
+
+    assert show(jacobian(['x*y+sin(z)', 'exp(x)', '3'], ['x', 'y', 'z'])) == [
+        ['y', 'x', 'cos(z)'], ['exp(x)', '0', '0'], ['0', '0', '0']]
+    assert sorted(jacobian(['x*y', 'exp(x)'], ['x', 'y'], sparse=True)) == [
+        (0, 0), (0, 1), (1, 0)]
+
+    matrix = hessian('x**2*y+sin(y*z)', ['x', 'y', 'z', 'w'])
+    assert isinstance(matrix, list)
+    assert show(matrix)[0] == ['2*y', '2*x', '0', '0']
+    assert show(matrix)[3] == ['0', '0', '0', '0']
+    assert matrix[1][2] is matrix[2][1]
+    assert interpret_ast(matrix[1][2]) == 'cos(y*z)+(-sin(y*z))*y*z'
+
+    entries = hessian('x**2*y+sin(y*z)', ['x', 'y', 'z', 'w'], sparse=True)
+    assert sorted(entries) == [(0, 0), (0, 1), (1, 0), (1, 1), (1, 2), (2, 1), (2, 2)]
+
+
+def test_lazy_deriv() -> None:
+    '''
+    Lazy derivatives force only what is inspected and materialize to
+    the eager derivative
+    '''
+    x = Var(Token(VAR, 'x'))
+    for expr in ['exp(x*y)/(x+1)', 'log(cot(cosec(x-1)))', '(x*y)*(y*x)', 'x**x']:
+        lazy = lazy_deriv(get_parsed_expr(expr), x)
+        assert interpret_ast(materialize(lazy)) == get_derivative(expr, 'x')
+        assert LazyInterpreter().interpret(lazy) == get_derivative(expr, 'x')
+
+    # full depth previews fold signs and numbers as the eager result does
+    for expr in ['1-(1+-(x+x))', '-((5)*2-(x+1))', 'sin(x-1)*-4/-(3-(x-y))',
+                 '-((x-5)+(3**4-(1+1)))*4**4', '2/(5*((4+x)**(x-x))**1)']:
+        lazy = lazy_deriv(get_parsed_expr(expr), x)
+        assert LazyInterpreter(max_depth=1000).interpret(lazy) == get_derivative(expr, 'x')
+
+    lazy = lazy_deriv(get_parsed_expr('sin(x*y)'), x)
+    assert lazy.evaluate({'x': 1, 'y': 2}) == pytest.approx(2 * math.cos(2))
+    assert lazy.forced is None
+
+    assert lazy_deriv(get_parsed_expr('(y+1)*(y-1)+x*0+x-x'), x).is_zero()
+    lazy = lazy_deriv(get_parsed_expr('sin(x)*(x*y+1)'), x)
+    assert not lazy.is_zero()
+    # the product rule sum is not a number as soon as its first term is
+    # not, so the thunk of sin(x) in its second term is never forced
+    assert lazy.thunks[id(lazy.source.left)].forced is None
+    assert lazy.thunks[id(lazy.source.right)].forced is not None
+
+    lazy = lazy_deriv(get_parsed_expr('cos(sec(x**2))+tan(x)'), x)
+    assert LazyInterpreter(max_depth=2).interpret(lazy) == '(...)*...+...**...'
+    # only printed nodes are forced, and nothing below them
+    assert lazy.thunks[id(lazy.source.left)].forced is not None
+    assert lazy.thunks[id(lazy.source.left.expr)].forced is None